@@ -1,23 +1,43 @@
 
 # === IMPORT & CONFIG ===
-import MetaTrader5 as mt5
+import os
+if os.environ.get("MT5_BACKEND", "").lower() == "sim":
+    import mt5_sim as mt5   # simulated terminal for load tests (see mt5_sim.py)
+else:
+    import MetaTrader5 as mt5
 import time
 import requests
 import numpy as np
 import gspread
 from datetime import datetime, timedelta, timezone
-from config import TELEGRAM_TOKEN, TELEGRAM_CHAT_ID
 from oauth2client.service_account import ServiceAccountCredentials
+import sys
 import logging
+import logging.handlers
+import gzip
+import shutil
+import atexit
 import traceback
 import threading
 import random
-import os
-
-# --- Plot backend for headless environments ---
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
+try:
+    from config import TELEGRAM_TOKEN, TELEGRAM_CHAT_ID
+except ImportError:
+    # offline tools (backtest/bench) run without the local config.py
+    TELEGRAM_TOKEN   = os.environ.get("TELEGRAM_TOKEN", "")
+    TELEGRAM_CHAT_ID = os.environ.get("TELEGRAM_CHAT_ID", "")
+import json
+import sqlite3
+import queue
+import itertools
+from concurrent.futures import Future
+from collections import namedtuple, deque
+from bisect import bisect_left, bisect_right
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, InvalidStateError
+import chart_render
+from numpy.lib.stride_tricks import sliding_window_view
 
 # === CONFIG ===
 SERVICE_ACCOUNT_FILE = r'F:\N8N\ForexSignal\Sheet\gsheet_creds.json'
@@ -93,29 +113,338 @@ CRYPTO_SYMBOLS = {"BTCUSD.A", "ETHUSD.A"}
 INDEX_SYMBOLS  = {"US30.A", "NAS100.A", "US500.A", "JPN225.A"}
 
 # --- Google Sheet auth ---
+# Opened on first use, not at import: chart worker processes re-import this script.
 scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-credentials   = ServiceAccountCredentials.from_json_keyfile_name(SERVICE_ACCOUNT_FILE, scope)
-gsheet_client = gspread.authorize(credentials)
-sheet         = gsheet_client.open_by_url(SHEET_URL).worksheet(SHEET_NAME)
-
-logging.basicConfig(
-    filename="signal_system.log",
-    format="%(asctime)s %(levelname)s %(message)s",
-    level=logging.INFO
-)
-
-# Cache: remember last root Telegram message id per symbol (only in-memory)
+_gsheet_client = None
+_sheet = None
+_SHEET_AUTH_LOCK = threading.Lock()
+
+def get_gsheet_client():
+    global _gsheet_client
+    with _SHEET_AUTH_LOCK:
+        if _gsheet_client is None:
+            credentials = ServiceAccountCredentials.from_json_keyfile_name(SERVICE_ACCOUNT_FILE, scope)
+            _gsheet_client = gspread.authorize(credentials)
+        return _gsheet_client
+
+def get_sheet():
+    global _sheet
+    if _sheet is None:
+        ws = get_gsheet_client().open_by_url(SHEET_URL).worksheet(SHEET_NAME)
+        with _SHEET_AUTH_LOCK:
+            _sheet = _sheet or ws
+    return _sheet
+
+def reload_sheet():
+    """Re-open the Signal worksheet; refreshes its cached properties (row_count)."""
+    global _sheet
+    book = get_sheet().spreadsheet
+    ws = _sheet_call_with_backoff("reload sheet", lambda: book.worksheet(SHEET_NAME))
+    with _SHEET_AUTH_LOCK:
+        _sheet = ws
+    return ws
+
+# Cache: remember last root Telegram message id per symbol (only in-memory);
+# holds the pending Future until the signal photo has actually been sent
 LAST_SIGNAL_MSG_ID = {}
 
 # === UTILITY ===
-def log(msg, level="info"):
-    print(msg)
-    if level == "error":
-        logging.error(msg)
-    elif level == "warning":
-        logging.warning(msg)
-    else:
-        logging.info(msg)
+# === LOGGING ===
+# log() only formats the record and drops it on a bounded queue; a listener thread
+# does the console/file I/O. The file gets one JSON object per line and rotates by
+# size and at midnight, older files gzipped. Categories are child loggers
+# ("signal.scan", "signal.telegram", ...) with their own level, and DEBUG records of a
+# category can be sampled so the per-symbol chatter does not flood the file.
+LOG_FILE            = "signal_system.log"
+LOG_LEVEL           = "INFO"
+LOG_CONSOLE_LEVEL   = "INFO"
+LOG_MAX_BYTES       = 20 * 1024 * 1024   # rotate when the file gets this big ...
+LOG_ROTATE_DAILY    = True               # ... or when the local date changes
+LOG_BACKUP_COUNT    = 14                 # gzipped files kept
+LOG_QUEUE_MAX       = 10000              # records beyond this are dropped, never waited for
+LOG_CATEGORY_LEVELS = {
+    "scan": "DEBUG",        # check_symbol skip reasons, one line per symbol per bar
+    "telegram": "INFO",     # DEBUG = every API response body
+}
+LOG_SAMPLING = {
+    "scan": 0.1,            # fraction of DEBUG records kept
+}
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "cat": record.name.split(".", 1)[1] if "." in record.name else record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class _RotatingGzipFileHandler(logging.handlers.RotatingFileHandler):
+    """RotatingFileHandler that also rolls over when the date changes and gzips
+    the rotated files (signal_system.log.1.gz, .2.gz, ...)."""
+
+    def __init__(self, filename, max_bytes, backup_count, daily=True):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        self.daily = daily
+        self.day = datetime.now().date()
+        self.namer = lambda name: name + ".gz"
+        self.rotator = self._gzip
+
+    @staticmethod
+    def _gzip(source, dest):
+        with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+
+    def shouldRollover(self, record):
+        if self.daily and datetime.now().date() != self.day:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        self.day = datetime.now().date()
+        super().doRollover()
+
+class _CategoryFilter(logging.Filter):
+    """Keeps a LOG_SAMPLING fraction of each category's DEBUG records."""
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        rate = LOG_SAMPLING.get(record.name.split(".", 1)[-1], 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("log_dropped_total")
+
+_logger = logging.getLogger("signal")
+_log_listener = None
+
+def setup_logging():
+    """Attach the queue handler and start the listener (once, from the main program).
+    Without it, log() records WARNING and above through Python's last-resort stderr handler."""
+    global _log_listener
+    if _log_listener is not None:
+        return
+    q = queue.Queue(maxsize=LOG_QUEUE_MAX)
+    console = logging.StreamHandler(sys.stdout)
+    console.setLevel(LOG_CONSOLE_LEVEL)
+    console.setFormatter(logging.Formatter("%(message)s"))
+    handlers = [console]
+    if LOG_FILE:
+        to_file = _RotatingGzipFileHandler(LOG_FILE, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_ROTATE_DAILY)
+        to_file.setFormatter(_JsonFormatter())
+        handlers.append(to_file)
+    qh = _NonBlockingQueueHandler(q)
+    qh.addFilter(_CategoryFilter())
+    # third-party libraries (urllib3, gspread, ...) log through the root logger
+    root = logging.getLogger()
+    root.addHandler(qh)
+    root.setLevel(logging.WARNING)
+    _logger.setLevel(LOG_LEVEL)
+    for cat, level in LOG_CATEGORY_LEVELS.items():
+        _logger.getChild(cat).setLevel(level)
+    _log_listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging():
+    """Flush what is still queued and stop the listener."""
+    global _log_listener
+    listener, _log_listener = _log_listener, None
+    if listener is not None:
+        listener.stop()
+
+_LOG_LEVELS = {"debug": logging.DEBUG, "info": logging.INFO, "warning": logging.WARNING, "error": logging.ERROR}
+
+def log(msg, level="info", category="main", **fields):
+    """Queue a log record; extra keyword fields (symbol=..., ...) go into the JSON line."""
+    logger = _logger.getChild(category)
+    levelno = _LOG_LEVELS.get(level, logging.INFO)
+    if logger.isEnabledFor(levelno):
+        logger.log(levelno, msg, extra={"fields": fields} if fields else None)
+
+# === METRICS ===
+# Stage latencies, counters and gauges in Prometheus text format, served on
+# http://METRICS_HTTP_HOST:METRICS_HTTP_PORT/metrics and written to METRICS_FILE.
+METRICS_HTTP_HOST = "127.0.0.1"
+METRICS_HTTP_PORT = 9108              # 0 = no HTTP endpoint
+METRICS_FILE = "signal_metrics.prom"  # "" = no file
+METRICS_FILE_INTERVAL_SEC = 60.0
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Metrics:
+    """Thread-safe counters, histograms and callback gauges keyed by name + labels."""
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.lock = threading.Lock()
+        self.buckets = buckets
+        self.counters = {}   # (name, labels) -> value
+        self.hists = {}      # (name, labels) -> [bucket counts..., sum, count]
+        self.gauges = {}     # name -> fn() returning a number
+        self.help = {}       # name -> (type, help text)
+
+    def describe(self, name, kind, text):
+        self.help[name] = (kind, text)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            h = self.hists.get(key)
+            if h is None:
+                h = self.hists[key] = [0] * len(self.buckets) + [0.0, 0]
+            i = bisect_left(self.buckets, seconds)
+            if i < len(self.buckets):
+                h[i] += 1
+            h[-2] += seconds
+            h[-1] += 1
+
+    def gauge(self, name, fn, text=""):
+        self.gauges[name] = fn
+        self.describe(name, "gauge", text)
+
+    def stage_timer(self, name, **labels):
+        return StageTimer(self, name, labels)
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        items = list(labels) + list(extra)
+        if not items:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+    def render(self):
+        """Prometheus text exposition of everything recorded so far."""
+        with self.lock:
+            counters = dict(self.counters)
+            hists = {k: list(v) for k, v in self.hists.items()}
+        lines, typed = [], set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                text = self.help.get(name, (kind, ""))[1]
+                if text:
+                    lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), v in sorted(counters.items()):
+            header(name, "counter")
+            lines.append(f"{name}{self._labels(labels)} {v}")
+        for (name, labels), h in sorted(hists.items()):
+            header(name, "histogram")
+            cum = 0
+            for le, n in zip(self.buckets, h):
+                cum += n
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', le)])} {cum}")
+            lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {h[-1]}")
+            lines.append(f"{name}_sum{self._labels(labels)} {h[-2]:.6f}")
+            lines.append(f"{name}_count{self._labels(labels)} {h[-1]}")
+        for name, fn in sorted(self.gauges.items()):
+            try:
+                v = float(fn())
+            except Exception:
+                continue
+            header(name, "gauge")
+            lines.append(f"{name} {v}")
+        return "\n".join(lines) + "\n"
+
+class StageTimer:
+    """Times consecutive stages of one pass: each lap() records the time since the
+    previous lap under label stage=<name>. Stages after an early return are simply
+    not recorded."""
+
+    def __init__(self, metrics, name, labels):
+        self.metrics, self.name, self.labels = metrics, name, labels
+        self.last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.metrics.observe(self.name, now - self.last, stage=stage, **self.labels)
+        self.last = now
+
+metrics = Metrics()
+for _name, _kind, _text in (
+    ("signal_stage_seconds", "histogram", "check_symbol time per stage"),
+    ("signal_symbol_seconds", "histogram", "check_symbol time per symbol"),
+    ("signal_scan_seconds", "histogram", "time to scan all symbols after a bar close"),
+    ("checker_iteration_seconds", "histogram", "one tp_sl_checker_loop pass"),
+    ("chart_render_seconds", "histogram", "chart submit to PNG ready"),
+    ("telegram_request_seconds", "histogram", "Telegram API request duration"),
+    ("mt5_calls_total", "counter", "MetaTrader5 API calls"),
+    ("mt5_failures_total", "counter", "MetaTrader5 calls that returned nothing"),
+    ("sheets_calls_total", "counter", "Google Sheets API calls"),
+    ("sheets_retries_total", "counter", "Google Sheets retries"),
+    ("sheets_rate_limited_total", "counter", "Google Sheets 429 / quota errors"),
+    ("chart_jobs_total", "counter", "chart jobs by result"),
+    ("telegram_requests_total", "counter", "Telegram API requests by status"),
+    ("telegram_retries_total", "counter", "Telegram retries"),
+    ("telegram_rate_limited_total", "counter", "Telegram 429 responses"),
+    ("bar_close_delay_seconds", "histogram", "bar close to job start, server time"),
+    ("bar_job_seconds", "histogram", "bar close job duration"),
+    ("bar_close_missed_total", "counter", "bar closes skipped by the scheduler"),
+    ("signals_total", "counter", "signals committed"),
+    ("orders_archived_total", "counter", "closed orders moved out of the Signal sheet"),
+    ("signal_errors_total", "counter", "check_symbol exceptions"),
+    ("checker_errors_total", "counter", "failed tp_sl_checker_loop passes"),
+    ("checker_results_total", "counter", "order results written by the checker"),
+):
+    metrics.describe(_name, _kind, _text)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass  # scrapes would flood the log
+
+def write_metrics_file(path=None):
+    path = path or METRICS_FILE
+    try:
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(metrics.render())
+        os.replace(tmp, path)
+    except Exception as e:
+        log(f"[Metrics] cannot write {path}: {e}", "warning", "metrics")
+
+def _metrics_file_loop():
+    while True:
+        time.sleep(METRICS_FILE_INTERVAL_SEC)
+        write_metrics_file()
+
+def start_metrics_exporters():
+    """Start the scrape endpoint and the periodic metrics file (each optional)."""
+    if METRICS_HTTP_PORT:
+        try:
+            server = ThreadingHTTPServer((METRICS_HTTP_HOST, METRICS_HTTP_PORT), _MetricsHandler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+            log(f"[Metrics] serving http://{METRICS_HTTP_HOST}:{METRICS_HTTP_PORT}/metrics", "info", "metrics")
+        except OSError as e:
+            log(f"[Metrics] cannot listen on {METRICS_HTTP_HOST}:{METRICS_HTTP_PORT}: {e}", "warning", "metrics")
+    if METRICS_FILE:
+        threading.Thread(target=_metrics_file_loop, name="metrics-file", daemon=True).start()
 
 # --- Cached Google Sheet fetch with exponential backoff & jitter ---
 _SHEET_CACHE_TS = 0.0
@@ -124,30 +453,26 @@ _SHEET_CACHE_TTL = 45.0  # seconds
 _SHEET_MAX_RETRIES = 6
 _SHEET_BASE_BACKOFF = 1.0
 
-def get_all_sheet_records_with_retry():
-    global _SHEET_CACHE_TS, _SHEET_CACHE_DATA
-    now_monotonic = time.monotonic()
-    # return cached data if still fresh
-    if _SHEET_CACHE_DATA is not None and (now_monotonic - _SHEET_CACHE_TS) < _SHEET_CACHE_TTL:
-        return _SHEET_CACHE_DATA
-
+def _sheet_call_with_backoff(label, fn):
+    """Run fn() with exponential backoff & jitter; raise after _SHEET_MAX_RETRIES."""
     last_err = None
     backoff = _SHEET_BASE_BACKOFF
     for i in range(1, _SHEET_MAX_RETRIES + 1):
+        metrics.inc("sheets_calls_total", op=label)
         try:
-            records = sheet.get_all_records()
-            _SHEET_CACHE_TS = time.monotonic()
-            _SHEET_CACHE_DATA = records
-            return records
+            return fn()
         except Exception as e:
             last_err = e
             msg = str(e)
             # Detect rate limit
             is_rate = ("429" in msg) or ("Quota exceeded" in msg) or ("Rate Limit" in msg)
+            if is_rate:
+                metrics.inc("sheets_rate_limited_total", op=label)
             # log and backoff
-            log(f"[GoogleSheet] Retry {i}: {e}", "warning")
+            log(f"[GoogleSheet] {label} Retry {i}: {e}", "warning", "sheet")
             if i >= _SHEET_MAX_RETRIES:
                 break
+            metrics.inc("sheets_retries_total", op=label)
             # exponential backoff with jitter; heavier if rate-limited
             sleep_s = backoff + (random.uniform(0, 0.5))
             if is_rate:
@@ -156,83 +481,409 @@ def get_all_sheet_records_with_retry():
                 sleep_s = 64.0
             time.sleep(sleep_s)
             backoff *= 2.0
-    raise Exception("GoogleSheet: Failed to get all records after retry.") from last_err
-def append_row_with_retry(row, max_retry=5):
-    for i in range(max_retry):
+    raise Exception(f"GoogleSheet: {label} failed after retry.") from last_err
+
+def get_all_sheet_records_with_retry(force=False):
+    global _SHEET_CACHE_TS, _SHEET_CACHE_DATA
+    now_monotonic = time.monotonic()
+    # return cached data if still fresh
+    if not force and _SHEET_CACHE_DATA is not None and (now_monotonic - _SHEET_CACHE_TS) < _SHEET_CACHE_TTL:
+        return _SHEET_CACHE_DATA
+    records = _sheet_call_with_backoff("get_all_records", lambda: get_sheet().get_all_records())
+    _SHEET_CACHE_TS = time.monotonic()
+    _SHEET_CACHE_DATA = records
+    return records
+
+# --- Sheet replication (journal -> Signal worksheet) ---
+# Appends and cell edits are committed to the local order journal (plus order_index)
+# and return immediately. sheet_writer_loop replicates the journal outbox as one
+# batch_update per burst. Rows are written to their fixed A1 range rather than
+# appended, so a batch that is re-sent after a failure or crash is idempotent. The
+# target rows are read first: rows added to the sheet by hand since the last reconcile
+# are imported, and the unsent orders they sit on move below them.
+SHEET_WRITE_WINDOW_SEC = 1.5     # how long a burst is collected before flushing
+SHEET_WRITE_FAIL_PAUSE = 10.0    # pause after a batch exhausted its retries
+SHEET_REPLICATE_IDLE_SEC = 30.0  # wake up this often even without new writes
+SHEET_GROW_ROWS = 200            # extra grid rows added when the sheet is full
+SHEET_SPARE_ROWS = 20            # grow before fewer than this many empty rows are left
+_SHEET_FLUSH_LOCK  = threading.Lock()
+_SHEET_WRITE_EVENT = threading.Event()
+
+def append_row_with_retry(row):
+    """Commit a new order row locally; returns its sheet row index."""
+    with order_index.lock:
+        ensure_order_index()
+        row_idx, rec = order_index.append(row)
+        order_journal.append(row_idx, rec, list(row))
+    _SHEET_WRITE_EVENT.set()
+    return row_idx
+
+def update_cell_with_retry(row, col, value):
+    with order_index.lock:
+        ensure_order_index()
+        rec = order_index.set_cell(row, col, value)
+        order_journal.set_cell(row, col, value, rec)
+    _SHEET_WRITE_EVENT.set()
+
+def _ensure_sheet_rows(last_row):
+    ws = get_sheet()
+    if ws.row_count < last_row + SHEET_SPARE_ROWS:
+        _sheet_call_with_backoff("add_rows", lambda: ws.add_rows(last_row - ws.row_count + SHEET_GROW_ROWS))
+
+def _claim_sheet_rows(rows):
+    """Check the sheet rows that unsent orders (`rows`) will be written to. Rows holding
+    another order are imported into the index and journal, and the unsent orders move
+    below the sheet's last used row. True when orders were moved (outbox renumbered)."""
+    ws = get_sheet()
+    first = min(rows)
+    if first > ws.row_count:
+        return False
+    headers = list(order_index.headers)
+    last_col = gspread.utils.rowcol_to_a1(1, len(headers))[:-1]
+    values = _sheet_call_with_backoff("check rows", lambda: ws.get(f"A{first}:{last_col}{ws.row_count}"))
+    found = {}
+    for i, v in enumerate(values):
+        v = gspread.utils.numericise_all(list(v)) + [""] * (len(headers) - len(v))
+        if any(x != "" for x in v):
+            found[first + i] = dict(zip(headers, v))
+    if not found:
+        return False
+    with order_index.lock:
+        unsent = order_journal.pending()[1]   # re-read: orders may have been added meanwhile
+        # a row holding our own order is a re-send after a crash, not a conflict
+        foreign = {r: rec for r, rec in found.items() if r not in order_index.rows
+                   or (r in unsent and _order_key(rec) != _order_key(order_index.rows[r]))}
+        moved = sorted(r for r in foreign if r in unsent)
+        if not moved:
+            return False   # rows added below ours are left to reconcile_order_index
+        start = max(max(found), order_index.next_row - 1) + 1
+        mapping = {r: start + i for i, r in enumerate(moved)}
+        imported = sorted(foreign.items())
+        order_journal.relocate(mapping, imported)
+        order_index.relocate(mapping, imported)
+    log(f"[GoogleSheet] {len(imported)} rows were added by hand; moved {len(moved)} unsent orders "
+        f"to rows {start}-{start + len(moved) - 1}", "warning", "sheet")
+    return True
+
+def flush_sheet_writes():
+    """Replicate the journal outbox to the sheet. Entries stay queued on failure."""
+    with _SHEET_FLUSH_LOCK:
+        # outbox rows are numbered after an archive run; its sheet deletion goes first
+        if not finish_pending_archive():
+            return False
+        last_id, rows, cells = order_journal.pending()
+        if not last_id:
+            return True
         try:
-            sheet.append_row(row)
-            return
+            # rows first: queued cell edits may target rows written in this batch
+            if rows:
+                if _claim_sheet_rows(rows):
+                    last_id, rows, cells = order_journal.pending()
+                _ensure_sheet_rows(max(rows))
+                data = [{'range': f"{gspread.utils.rowcol_to_a1(r, 1)}:{gspread.utils.rowcol_to_a1(r, len(v))}",
+                         'values': [v]} for r, v in sorted(rows.items())]
+                _sheet_call_with_backoff(
+                    "batch_update rows", lambda: get_sheet().batch_update(data, value_input_option="RAW"))
+            if cells:
+                data = [{'range': gspread.utils.rowcol_to_a1(r, c), 'values': [[v]]}
+                        for (r, c), v in sorted(cells.items())]
+                _sheet_call_with_backoff(
+                    "batch_update cells", lambda: get_sheet().batch_update(data, value_input_option="USER_ENTERED"))
         except Exception as e:
-            log(f"[GoogleSheet] append_row Retry {i+1}: {e}", "warning")
-            time.sleep(2)
-    raise Exception("GoogleSheet: Failed to append row after retry.")
+            log(f"[GoogleSheet] replication failed, {len(rows)} rows / {len(cells)} cells kept in journal: {e}", "error", "sheet")
+            return False
+        order_journal.ack(last_id)
+        return True
 
-def update_cell_with_retry(row, col, value, max_retry=5):
-    for i in range(max_retry):
+def sheet_writer_loop():
+    _SHEET_WRITE_EVENT.set()  # replicate whatever a previous run left in the journal
+    last_reconcile = time.monotonic()
+    last_archive = 0.0
+    while True:
+        if _SHEET_WRITE_EVENT.wait(timeout=SHEET_REPLICATE_IDLE_SEC):
+            time.sleep(SHEET_WRITE_WINDOW_SEC)  # let the burst coalesce
+        _SHEET_WRITE_EVENT.clear()
         try:
-            sheet.update_cell(row, col, value)
-            return
+            if not flush_sheet_writes():
+                time.sleep(SHEET_WRITE_FAIL_PAUSE)
+                continue
+            if time.monotonic() - last_reconcile >= ORDER_INDEX_RECONCILE_SEC:
+                last_reconcile = time.monotonic()
+                reconcile_order_index()
+            if ARCHIVE_TARGET and time.monotonic() - last_archive >= ARCHIVE_INTERVAL_SEC:
+                last_archive = time.monotonic()
+                archive_closed_orders()
         except Exception as e:
-            log(f"[GoogleSheet] update_cell Retry {i+1}: {e}", "warning")
-            time.sleep(2)
-    raise Exception("GoogleSheet: Failed to update cell after retry.")
+            log(f"[GoogleSheet] writer error: {e}", "error", "sheet")
+            time.sleep(SHEET_WRITE_FAIL_PAUSE)
 
 def log_daily_summary_to_sheet(date, total, tp, sl, expired):
     try:
-        sheet_summary = gsheet_client.open_by_url(SHEET_URL).worksheet("DailySummary")
+        sheet_summary = get_gsheet_client().open_by_url(SHEET_URL).worksheet("DailySummary")
         sheet_summary.append_row([date, total, tp, sl, expired])
     except Exception as e:
-        log(f"[GoogleSheet] Log Daily Summary Fail: {e}", "warning")
+        log(f"[GoogleSheet] Log Daily Summary Fail: {e}", "warning", "sheet")
 
 # Telegram
-def send_telegram_message(text, reply_to_message_id=None, parse_mode="Markdown"):
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-    payload = {"chat_id": TELEGRAM_CHAT_ID, "text": text, "parse_mode": parse_mode}
-    if reply_to_message_id:
-        payload["reply_to_message_id"] = reply_to_message_id
-        payload["allow_sending_without_reply"] = True
-    try:
-        r = requests.post(url, data=payload)
-        print(f"[Telegram Debug] status_code={r.status_code}, response={r.text}")
-        if not r.ok:
-            log(f"Telegram API Error: {r.text}", "warning")
-        else:
-            data = r.json()
-            return data.get("result", {}).get("message_id")
-    except Exception as e:
-        log(f"Telegram Error: {e}", "error")
-    return None
-
-def send_telegram_photo(image_path, caption=None, parse_mode=None):
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendPhoto"
-    message_id = None
-    try:
-        with open(image_path, "rb") as photo:
-            data = {"chat_id": TELEGRAM_CHAT_ID}
-            if caption:
-                data["caption"] = caption
-            if parse_mode:
-                data["parse_mode"] = parse_mode
-            r = requests.post(url, data=data, files={"photo": photo})
-        print(f"[Telegram Debug] (photo) status_code={r.status_code}, response={r.text}")
-        if not r.ok:
-            log(f"Telegram API Error (photo): {r.text}", "warning")
-        else:
+# One background worker owns a pooled HTTP session and delivers everything from a
+# bounded priority queue, so a slow or rate-limited API call never stalls a scan.
+TELEGRAM_API_URL          = "https://api.telegram.org/bot{token}/{method}"
+TELEGRAM_QUEUE_MAX        = 200
+TELEGRAM_ENQUEUE_TIMEOUT  = 5.0    # signals wait this long for room; others are dropped
+TELEGRAM_CHAT_MIN_INTERVAL= 1.0    # seconds between messages to the same chat
+TELEGRAM_MAX_RETRIES      = 5
+TELEGRAM_BACKOFF_BASE     = 1.0
+TELEGRAM_HTTP_TIMEOUT     = (5, 30)  # connect, read
+TELEGRAM_REPLY_WAIT_SEC   = 60.0   # a reply whose parent isn't sent by then goes out alone (> CHART_JOB_TIMEOUT_SEC)
+
+# lower = sent first; equal priorities keep submit order
+TG_PRIORITY_SIGNAL  = 0   # entry chart + signal text
+TG_PRIORITY_UPDATE  = 1   # TP/SL/Expired/BE replies
+TG_PRIORITY_SUMMARY = 2   # daily/weekly summaries
+
+class TelegramSender:
+    """Background Telegram delivery: persistent requests.Session, bounded PriorityQueue,
+    per-chat pacing and retries that honor `retry_after`.
+
+    submit() returns a Future resolved with the message_id (None on failure).
+    `reply_to` may itself be such a Future; the reply is held aside until it resolves
+    (at most TELEGRAM_REPLY_WAIT_SEC, then it is sent without the reply). The worker
+    thread starts on first use.
+    """
+
+    def __init__(self):
+        self.queue = queue.PriorityQueue(maxsize=TELEGRAM_QUEUE_MAX)
+        self.seq = itertools.count()
+        self.next_send = {}   # chat_id -> monotonic time of the next allowed send
+        self.parked = {}      # seq -> item held off the queue (reply_to pending, backoff)
+        self.held = {}        # chat_id -> items waiting out the chat's retry_after
+        self.session = None
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def _ensure_worker(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._worker, name="telegram-sender", daemon=True)
+                self.thread.start()
+
+    def submit(self, method, data, files=None, priority=TG_PRIORITY_UPDATE, reply_to=None):
+        fut = Future()
+        self._ensure_worker()
+        item = (priority, next(self.seq), method, dict(data), files, reply_to, fut, 0)
+        try:
+            if priority == TG_PRIORITY_SIGNAL:
+                self.queue.put(item, timeout=TELEGRAM_ENQUEUE_TIMEOUT)
+            else:
+                self.queue.put_nowait(item)
+        except queue.Full:
+            log(f"Telegram queue full, dropped {method}", "warning", "telegram")
+            fut.set_result(None)
+        return fut
+
+    def _requeue(self, item, delay=0.0):
+        """Put an item back in the queue at its original place (priority, seq). With a
+        `delay`, a timer holds it off the queue meanwhile; the worker keeps sending."""
+        if delay:
+            with self.lock:
+                self.parked[item[1]] = item
+
+            def release():
+                with self.lock:   # queued before un-parking, so flush() never sees a gap
+                    self._requeue(item)
+                    self.parked.pop(item[1], None)
+
+            timer = threading.Timer(delay, release)
+            timer.daemon = True
+            timer.start()
+            return
+        # the worker is the only consumer, so never block on a full queue here
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            method, fut = item[2], item[6]
+            log(f"Telegram queue full, dropped {method}", "warning", "telegram")
+            fut.set_result(None)
+
+    def _hold_for_chat(self, chat, item, wait):
+        """Keep a rate-limited chat's items off the queue; one timer puts them all back
+        when the limit ends, best (priority, seq) first, so their order is kept."""
+        with self.lock:
+            items = self.held.setdefault(chat, [])
+            items.append(item)
+            if len(items) > 1:
+                return
+
+        def release():
+            with self.lock:
+                for it in sorted(self.held.get(chat, []), key=lambda it: it[:2]):
+                    self._requeue(it)
+                self.held.pop(chat, None)
+
+        timer = threading.Timer(wait, release)
+        timer.daemon = True
+        timer.start()
+
+    def _park(self, item):
+        """Hold a reply off the queue until its parent Future resolves; requeue it then,
+        or without the reply after TELEGRAM_REPLY_WAIT_SEC."""
+        key = item[1]
+        with self.lock:
+            self.parked[key] = item
+
+        def release(timed_out=False):
+            with self.lock:
+                held = self.parked.get(key)
+                if held is None:
+                    return
+                if timed_out:
+                    held = held[:5] + (None,) + held[6:]
+                self._requeue(held)
+                del self.parked[key]
+            timer.cancel()
+            if timed_out:
+                log(f"Telegram reply parent not sent in {TELEGRAM_REPLY_WAIT_SEC:.0f}s, sending {held[2]} without reply",
+                    "warning", "telegram")
+
+        timer = threading.Timer(TELEGRAM_REPLY_WAIT_SEC, release, kwargs={"timed_out": True})
+        timer.daemon = True
+        timer.start()
+        item[5].add_done_callback(lambda f: release())
+
+    def _worker(self):
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=2)
+        self.session.mount("https://", adapter)
+        while True:
+            item = self.queue.get()
             try:
-                js = r.json()
-                message_id = js.get("result", {}).get("message_id")
+                self._deliver(item)
+            except Exception as e:
+                log(f"Telegram Error: {e}", "error", "telegram")
+                if not item[6].done():
+                    item[6].set_result(None)
+            finally:
+                self.queue.task_done()
+
+    def _deliver(self, item):
+        priority, _, method, data, files, reply_to, fut, attempt = item
+        if isinstance(reply_to, Future):
+            if not reply_to.done():
+                self._park(item)   # parent message not sent yet
+                return
+            reply_to = reply_to.result()
+        if reply_to:
+            data["reply_to_message_id"] = reply_to
+            data["allow_sending_without_reply"] = True
+
+        chat = data.get("chat_id")
+        wait = self.next_send.get(chat, 0.0) - time.monotonic()
+        if wait > TELEGRAM_CHAT_MIN_INTERVAL:
+            return self._hold_for_chat(chat, item, wait)   # retry_after from a 429
+        if wait > 0:
+            time.sleep(wait)
+        self.next_send[chat] = time.monotonic() + TELEGRAM_CHAT_MIN_INTERVAL
+
+        url = TELEGRAM_API_URL.format(token=TELEGRAM_TOKEN, method=method)
+        t0 = time.perf_counter()
+        try:
+            r = self.session.post(url, data=data, files=files, timeout=TELEGRAM_HTTP_TIMEOUT)
+        except requests.RequestException as e:
+            metrics.inc("telegram_requests_total", method=method, status="error")
+            return self._retry(item, f"{e}", None)
+        metrics.observe("telegram_request_seconds", time.perf_counter() - t0, method=method)
+        metrics.inc("telegram_requests_total", method=method, status=str(r.status_code))
+        log(f"[Telegram Debug] ({method}) status_code={r.status_code}, response={r.text}", "debug", "telegram",
+            method=method, status=r.status_code)
+        if r.ok:
+            try:
+                fut.set_result(r.json().get("result", {}).get("message_id"))
             except Exception:
-                pass
-    except Exception as e:
-        log(f"Telegram Photo Error: {e}", "error")
-    finally:
-        # Always try to remove local file
+                fut.set_result(None)
+            return
+        if r.status_code == 429 or r.status_code >= 500:
+            try:
+                retry_after = r.json().get("parameters", {}).get("retry_after")
+            except Exception:
+                retry_after = None
+            if r.status_code == 429:
+                metrics.inc("telegram_rate_limited_total", method=method)
+            if retry_after:
+                # Telegram's limit applies to the whole chat, not just this message
+                self.next_send[chat] = time.monotonic() + float(retry_after)
+            return self._retry(item, r.text, retry_after)
+        log(f"Telegram API Error ({method}): {r.text}", "warning", "telegram")
+        fut.set_result(None)
+
+    def _retry(self, item, reason, retry_after):
+        attempt = item[7] + 1
+        if attempt > TELEGRAM_MAX_RETRIES:
+            log(f"Telegram give up after {attempt - 1} retries ({item[2]}): {reason}", "error", "telegram")
+            item[6].set_result(None)
+            return
+        delay = 0.0 if retry_after else TELEGRAM_BACKOFF_BASE * (2 ** (attempt - 1)) * (0.5 + random.random())
+        log(f"Telegram retry {attempt}/{TELEGRAM_MAX_RETRIES} ({item[2]}): {reason}", "warning", "telegram")
+        metrics.inc("telegram_retries_total", method=item[2])
+        self._requeue(item[:7] + (attempt,), delay)
+
+    def flush(self, timeout=None):
+        """Wait until the queue is drained and nothing is held off it (or timeout); True when empty."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.queue.unfinished_tasks or self.parked or self.held:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.1)
+        return True
+
+telegram_sender = TelegramSender()
+metrics.gauge("telegram_queue_size", lambda: telegram_sender.queue.qsize(), "Telegram messages waiting")
+
+def send_telegram_message(text, reply_to_message_id=None, parse_mode="Markdown", priority=TG_PRIORITY_UPDATE):
+    """Queue a text message; returns a Future of its message_id.
+    `reply_to_message_id` may be an id or a Future from an earlier send."""
+    payload = {"chat_id": TELEGRAM_CHAT_ID, "text": text, "parse_mode": parse_mode}
+    return telegram_sender.submit("sendMessage", payload, priority=priority, reply_to=reply_to_message_id)
+
+def send_telegram_photo(photo, caption=None, parse_mode=None, priority=TG_PRIORITY_SIGNAL, filename="chart.png"):
+    """Queue a photo given as PNG bytes (or a file path, which is read and removed);
+    returns a Future of its message_id."""
+    content = photo if isinstance(photo, (bytes, bytearray)) else None
+    if content is None:
         try:
-            if os.path.exists(image_path):
-                os.remove(image_path)
+            with open(photo, "rb") as fh:
+                content = fh.read()
+            filename = os.path.basename(photo)
         except Exception as e:
-            log(f"Warning: cannot delete temp chart {image_path}: {e}", "warning")
-    return message_id
+            log(f"Telegram Photo Error: {e}", "error", "telegram")
+        finally:
+            try:
+                if os.path.exists(photo):
+                    os.remove(photo)
+            except Exception as e:
+                log(f"Warning: cannot delete temp chart {photo}: {e}", "warning", "telegram")
+    if not content:
+        fut = Future()
+        fut.set_result(None)
+        return fut
+    data = {"chat_id": TELEGRAM_CHAT_ID}
+    if caption:
+        data["caption"] = caption
+    if parse_mode:
+        data["parse_mode"] = parse_mode
+    files = {"photo": (filename, content)}
+    return telegram_sender.submit("sendPhoto", data, files=files, priority=priority)
+
+def remember_signal_message(symbol, fut):
+    """Thread later replies under `fut`'s message; swap in the plain id once sent."""
+    LAST_SIGNAL_MSG_ID[symbol] = fut
+    def _done(f):
+        msg_id = f.result()
+        if LAST_SIGNAL_MSG_ID.get(symbol) is f:
+            if msg_id:
+                LAST_SIGNAL_MSG_ID[symbol] = msg_id
+            else:
+                LAST_SIGNAL_MSG_ID.pop(symbol, None)
+    fut.add_done_callback(_done)
 
 # Helpers
 def format_price(value, digits):
@@ -250,7 +901,7 @@ def get_float_safe(d, key):
         result = float(v)
         return result
     except Exception as e:
-        print(f"get_float_safe error: {key}={v} ({e})")
+        log(f"get_float_safe error: {key}={v} ({e})", "warning")
         return None
 
 # === unified open/closed checks ===
@@ -259,16 +910,464 @@ CLOSED_RESULTS = {"TP1", "TP2", "TP3", "SL", "Expired"}
 def is_closed_result(res):
     return str(res).strip() in CLOSED_RESULTS
 
+# === ORDER INDEX ===
+# In-memory view of all orders keyed by row, symbol and status, loaded from the
+# order journal and updated write-through with it, so lock, dedup and checker
+# lookups never scan (or download) the whole sheet.
+ORDER_INDEX_RECONCILE_SEC = 60.0   # delta-read the sheet for hand edits this often
+SHEET_MUTABLE_COLUMNS = ("Result", "SL", "Note")  # columns that change after a row is written
+ORDER_KEY_COLUMNS = ("Date", "Symbol", "Direction")  # identify an order row (sheet, archive)
+
+def _order_key(rec):
+    return tuple(str(rec.get(h, "")) for h in ORDER_KEY_COLUMNS)
+
+class OrderIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.headers = []
+        self.rows = {}            # row_idx -> record dict (replaced, never mutated)
+        self.open_rows = {}       # row_idx -> record, Result not in CLOSED_RESULTS
+        self.open_by_symbol = {}  # symbol -> set(row_idx)
+        self.last_by_symbol = {}  # symbol -> newest row_idx for that symbol
+        self.next_row = 2         # row 1 is the header
+        self.loaded_at = None     # time.monotonic() of the last full load
+        self.version = 0          # bumped on every change (TP/SL trigger index rebuilds on it)
+        self.epoch = 0            # bumped when rows are renumbered (held row numbers are stale)
+
+    def load(self, rows, headers):
+        """rows: iterable of (row_idx, record)."""
+        with self.lock:
+            self.headers = list(headers)
+            self.rows, self.open_rows = {}, {}
+            self.open_by_symbol, self.last_by_symbol = {}, {}
+            self.next_row = 2
+            for row_idx, rec in rows:
+                self.add(row_idx, rec)
+            self.version += 1
+            self.loaded_at = time.monotonic()
+
+    def add(self, row_idx, rec):
+        with self.lock:
+            self.version += 1
+            sym = rec.get('Symbol', '')
+            self.rows[row_idx] = rec
+            if is_closed_result(rec.get('Result', '')):
+                self.open_rows.pop(row_idx, None)
+                self.open_by_symbol.get(sym, set()).discard(row_idx)
+            else:
+                self.open_rows[row_idx] = rec
+                self.open_by_symbol.setdefault(sym, set()).add(row_idx)
+            if row_idx >= self.last_by_symbol.get(sym, 0):
+                self.last_by_symbol[sym] = row_idx
+            self.next_row = max(self.next_row, row_idx + 1)
+
+    def append(self, row):
+        """Add a new sheet row (list in header order); returns (row_idx, record)."""
+        with self.lock:
+            headers = self.headers or [str(i) for i in range(len(row))]
+            values = list(row) + [""] * (len(headers) - len(row))
+            row_idx, rec = self.next_row, dict(zip(headers, values))
+            self.add(row_idx, rec)
+            return row_idx, rec
+
+    def set_cell(self, row_idx, col, value):
+        """Apply a cell edit; returns the new record (None for unknown rows/columns)."""
+        with self.lock:
+            rec = self.rows.get(row_idx)
+            if rec is None or not (1 <= col <= len(self.headers)):
+                return None
+            new = dict(rec)
+            new[self.headers[col - 1]] = value
+            self.add(row_idx, new)
+            return new
+
+    def renumber(self, removed):
+        """Drop the `removed` rows and move the rows below them up, as deleting them
+        from the sheet does; returns {old row_idx: new row_idx} of the rows kept."""
+        with self.lock:
+            removed = set(removed)
+            mapping, shift = {}, 0
+            for r in sorted(self.rows):
+                if r in removed:
+                    shift += 1
+                else:
+                    mapping[r] = r - shift
+            next_row = self.next_row - len(removed)
+            self.load([(mapping[r], self.rows[r]) for r in sorted(mapping)], self.headers)
+            self.next_row = max(self.next_row, next_row)
+            self.epoch += 1
+            return mapping
+
+    def relocate(self, mapping, imported=()):
+        """Move rows to new numbers (old -> new) and add `imported` (row_idx, record),
+        rows found on the sheet where the moved ones were."""
+        with self.lock:
+            rows = [(mapping.get(r, r), rec) for r, rec in self.rows.items()] + list(imported)
+            self.load(sorted(rows, key=lambda x: x[0]), self.headers)
+            self.epoch += 1
+
+    def open_orders(self):
+        with self.lock:
+            return sorted(self.open_rows.items())
+
+    def has_open(self, symbol=None):
+        with self.lock:
+            if symbol is None:
+                return bool(self.open_rows)
+            return bool(self.open_by_symbol.get(symbol))
+
+    def last_for_symbol(self, symbol):
+        with self.lock:
+            row_idx = self.last_by_symbol.get(symbol)
+            return self.rows.get(row_idx) if row_idx else None
+
+    def records(self):
+        with self.lock:
+            return [self.rows[k] for k in sorted(self.rows)]
+
+order_index = OrderIndex()
+
+# === ORDER JOURNAL ===
+# Local SQLite (WAL) store and primary copy of order state. Each append / cell edit
+# commits the new record together with an outbox entry; sheet_writer_loop pushes
+# the outbox to the Signal sheet and deletes what the sheet accepted.
+ORDER_JOURNAL_FILE = "orders_journal.db"
+
+class OrderJournal:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self._db = None
+
+    @property
+    def db(self):
+        if self._db is None:
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS meta   (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS orders (row_idx INTEGER PRIMARY KEY, data TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                                   row_idx INTEGER NOT NULL,
+                                                   col INTEGER NOT NULL,  -- 0 = whole row
+                                                   value TEXT NOT NULL);
+            """)
+            self._db = db
+        return self._db
+
+    def load(self):
+        """(headers, [(row_idx, record), ...]); headers == [] for a new journal."""
+        with self.lock:
+            meta = self.db.execute("SELECT value FROM meta WHERE key = 'headers'").fetchone()
+            rows = self.db.execute("SELECT row_idx, data FROM orders ORDER BY row_idx").fetchall()
+        return (json.loads(meta[0]) if meta else []), [(r, json.loads(d)) for r, d in rows]
+
+    def import_rows(self, headers, rows):
+        """Store rows that already exist in the sheet (nothing to replicate)."""
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('headers', ?)", (json.dumps(headers),))
+            self.db.executemany("INSERT OR REPLACE INTO orders VALUES (?, ?)",
+                                [(r, json.dumps(rec, default=str)) for r, rec in rows])
+
+    def append(self, row_idx, rec, values):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO orders VALUES (?, ?)", (row_idx, json.dumps(rec, default=str)))
+            self.db.execute("INSERT INTO outbox (row_idx, col, value) VALUES (?, 0, ?)",
+                            (row_idx, json.dumps(values, default=str)))
+
+    def set_cell(self, row_idx, col, value, rec=None):
+        with self.lock, self.db:
+            if rec is not None:
+                self.db.execute("UPDATE orders SET data = ? WHERE row_idx = ?", (json.dumps(rec, default=str), row_idx))
+            self.db.execute("INSERT INTO outbox (row_idx, col, value) VALUES (?, ?, ?)",
+                            (row_idx, col, json.dumps(value, default=str)))
+
+    def pending(self):
+        """(last outbox id or 0, {row: values}, {(row, col): value}); later entries win."""
+        with self.lock:
+            entries = self.db.execute("SELECT id, row_idx, col, value FROM outbox ORDER BY id").fetchall()
+        rows, cells = {}, {}
+        for _, r, c, v in entries:
+            if c == 0:
+                rows[r] = json.loads(v)
+            else:
+                cells[(r, c)] = json.loads(v)
+        return (entries[-1][0] if entries else 0), rows, cells
+
+    def pending_count(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def get_meta(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_meta(self, key, value):
+        with self.lock, self.db:
+            if value is None:
+                self.db.execute("DELETE FROM meta WHERE key = ?", (key,))
+            else:
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, json.dumps(value)))
+
+    def archive(self, removed, mapping, pending):
+        """Drop archived rows and renumber the rest (old -> new) in one transaction,
+        together with the 'archive_pending' marker for the sheet deletion. Queued
+        outbox entries are renumbered too; they are replicated after the deletion."""
+        gone = sorted(removed)
+        with self.lock, self.db:
+            self.db.executemany("DELETE FROM orders WHERE row_idx = ?", [(r,) for r in gone])
+            # ascending: every target row_idx is already free (rows only move up)
+            self.db.executemany("UPDATE orders SET row_idx = ? WHERE row_idx = ?",
+                                [(new, old) for old, new in sorted(mapping.items()) if new != old])
+            self.db.executemany("DELETE FROM outbox WHERE row_idx = ?", [(r,) for r in gone])
+            queued = [r for (r,) in self.db.execute("SELECT DISTINCT row_idx FROM outbox ORDER BY row_idx")]
+            self.db.executemany("UPDATE outbox SET row_idx = ? WHERE row_idx = ?",
+                                [(r - bisect_left(gone, r), r) for r in queued if bisect_left(gone, r)])
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('archive_pending', ?)", (json.dumps(pending),))
+
+    def relocate(self, mapping, imported=()):
+        """Move rows (old -> new) together with their queued outbox entries and store
+        `imported` rows that already exist in the sheet, in one transaction."""
+        moves = [(-new, old) for old, new in mapping.items()]
+        with self.lock, self.db:
+            # through negative numbers: a target may still be held by a row that moves too
+            for table in ("orders", "outbox"):
+                self.db.executemany(f"UPDATE {table} SET row_idx = ? WHERE row_idx = ?", moves)
+                self.db.execute(f"UPDATE {table} SET row_idx = -row_idx WHERE row_idx < 0")
+            self.db.executemany("INSERT OR REPLACE INTO orders VALUES (?, ?)",
+                                [(r, json.dumps(rec, default=str)) for r, rec in imported])
+
+    def ack(self, last_id):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM outbox WHERE id <= ?", (last_id,))
+
+order_journal = OrderJournal(ORDER_JOURNAL_FILE)
+metrics.gauge("open_orders", lambda: len(order_index.open_rows), "Pending/Running rows in the order index")
+metrics.gauge("journal_outbox_pending", lambda: order_journal.pending_count(), "journal writes not yet on the sheet")
+
+def ensure_order_index():
+    """Load the index from the journal on first use (seeding the journal from the sheet once)."""
+    with order_index.lock:
+        if order_index.loaded_at is None:
+            headers, rows = order_journal.load()
+            if not headers:
+                records = get_all_sheet_records_with_retry(force=True)
+                headers = list(records[0].keys()) if records else get_sheet().row_values(1)
+                rows = list(enumerate(records, start=2))
+                order_journal.import_rows(headers, rows)
+                log(f"[Journal] seeded {len(rows)} rows from the sheet", "info", "sheet")
+            order_index.load(rows, headers)
+    return order_index
+
+def _row_runs(rows):
+    """Sorted row numbers -> [(first, last), ...] of consecutive runs."""
+    runs = []
+    for r in rows:
+        if runs and r == runs[-1][1] + 1:
+            runs[-1][1] = r
+        else:
+            runs.append([r, r])
+    return [tuple(run) for run in runs]
+
+def read_sheet_delta(next_row, open_rows, headers):
+    """One batch_get instead of get_all_records: every row from `next_row` down (an open
+    A1 range ends at the last non-empty row) plus the SHEET_MUTABLE_COLUMNS cells of the
+    still-open rows. Returns ({row_idx: record} of new rows, {row_idx: {header: value}})."""
+    last_col = gspread.utils.rowcol_to_a1(1, len(headers))[:-1]
+    # a range starting below the grid is rejected; no rows can have been added there
+    read_new = next_row <= get_sheet().row_count
+    ranges = [f"A{next_row}:{last_col}"] if read_new else []
+    cols = [(h, gspread.utils.rowcol_to_a1(1, headers.index(h) + 1)[:-1])
+            for h in SHEET_MUTABLE_COLUMNS if h in headers]
+    runs = _row_runs(sorted(open_rows))
+    for _, c in cols:
+        ranges.extend(f"{c}{first}:{c}{last}" for first, last in runs)
+    if not ranges:
+        return {}, {}
+    result = _sheet_call_with_backoff("batch_get delta", lambda: get_sheet().batch_get(ranges))
+
+    # same conversion as get_all_records: numbers parsed, short rows padded with ""
+    new = {}
+    for i, values in enumerate(result[0] if read_new else []):
+        values = gspread.utils.numericise_all(list(values)) + [""] * (len(headers) - len(values))
+        if any(v != "" for v in values):
+            new[next_row + i] = dict(zip(headers, values))
+    edits = {}
+    k = 1 if read_new else 0
+    for h, _ in cols:
+        for first, last in runs:
+            block = result[k] if k < len(result) else []
+            k += 1
+            for r in range(first, last + 1):
+                cell = block[r - first] if r - first < len(block) else []
+                value = gspread.utils.numericise_all(list(cell))[0] if cell else ""
+                edits.setdefault(r, {})[h] = value
+    return new, edits
+
+def reconcile_order_index():
+    """Pull hand edits from the sheet with a delta read: rows added below the known
+    ones, and Result/SL/Note changes of open rows. Skipped while local writes are still
+    being replicated (or an archive deletion is pending), so the journal's own pending
+    edits are never overwritten."""
+    with order_index.lock:
+        ensure_order_index()
+        if order_journal.pending_count() or order_journal.get_meta("archive_pending"):
+            return
+        next_row, headers = order_index.next_row, list(order_index.headers)
+        open_rows = list(order_index.open_rows)
+    new, edits = read_sheet_delta(next_row, open_rows, headers)
+    with order_index.lock:
+        if order_journal.pending_count() or order_index.next_row != next_row:
+            return  # a local write raced the read; next pass picks the sheet up again
+        changed = []
+        for r, fields in edits.items():
+            rec = order_index.rows.get(r)
+            if rec is not None and any(str(rec.get(h, "")) != str(v) for h, v in fields.items()):
+                changed.append((r, {**rec, **fields}))
+        rows = sorted(new.items()) + changed
+        if rows:
+            order_journal.import_rows(headers, rows)
+            for r, rec in rows:
+                order_index.add(r, rec)
+        if new:
+            log(f"[Journal] imported {len(new)} rows added to the sheet", "info", "sheet")
+        if changed:
+            log(f"[Journal] imported hand edits of {len(changed)} open rows", "info", "sheet")
+
 def find_open_orders():
-    records = get_all_sheet_records_with_retry()
-    open_orders = []
-    for i, r in enumerate(records, start=2):
-        if not is_closed_result(r.get('Result', '')):
-            open_orders.append((i, r))
-    return open_orders
+    return ensure_order_index().open_orders()
+
+# === ORDER ARCHIVE ===
+# Closed orders older than ARCHIVE_RETENTION_DAYS move out of the Signal sheet in bulk,
+# into one worksheet per month (ARCHIVE_SHEET_PREFIX + "YYYY-MM") or a gzipped JSON-lines
+# file per month. The rows below move up in the sheet, so the journal and the index
+# renumber theirs (queued outbox entries included) in the same step. The journal commits
+# the renumbering first, with an "archive_pending" marker; the writer then deletes the
+# sheet rows in one batch_update before it replicates anything else, also after a
+# restart. Only the local step holds order_index.lock, never a Sheets call.
+# Off by default: either target deletes rows from the live Signal sheet, so turning it
+# on is the operator's call.
+ARCHIVE_TARGET         = ""          # "sheet", "file" or "" (off)
+ARCHIVE_RETENTION_DAYS = 14          # keep at least a week for the weekly summary
+ARCHIVE_INTERVAL_SEC   = 3600.0
+ARCHIVE_MIN_ROWS       = 50          # don't bother moving fewer rows than this
+ARCHIVE_SHEET_PREFIX   = "Signal_"
+ARCHIVE_DIR            = "archive"   # for ARCHIVE_TARGET = "file"
+
+def _archive_worksheet(title, headers):
+    book = get_sheet().spreadsheet
+    # listed rather than opened by title: a missing sheet is expected, not a retry
+    for ws in _sheet_call_with_backoff("archive worksheets", book.worksheets):
+        if ws.title == title:
+            return ws
+    ws = _sheet_call_with_backoff(
+        "archive add sheet", lambda: book.add_worksheet(title=title, rows=1000, cols=len(headers)))
+    _sheet_call_with_backoff("archive header", lambda: ws.update("A1", [headers]))
+    return ws
+
+def write_archive(month, headers, records):
+    """Add records to the month's archive, skipping ones already there (a run that was
+    interrupted after the copy). Returns how many were written."""
+    if ARCHIVE_TARGET == "file":
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        path = os.path.join(ARCHIVE_DIR, f"{ARCHIVE_SHEET_PREFIX}{month}.jsonl.gz")
+        existing = set()
+        if os.path.exists(path):
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                existing = {_order_key(json.loads(line)) for line in f if line.strip()}
+        new = [rec for rec in records if _order_key(rec) not in existing]
+        with gzip.open(path, "at", encoding="utf-8") as f:
+            for rec in new:
+                f.write(json.dumps(rec, ensure_ascii=False, default=str) + "\n")
+        return len(new)
+    ws = _archive_worksheet(f"{ARCHIVE_SHEET_PREFIX}{month}", headers)
+    last_col = gspread.utils.rowcol_to_a1(1, len(ORDER_KEY_COLUMNS))[:-1]
+    values = _sheet_call_with_backoff("archive keys", lambda: ws.get(f"A2:{last_col}"))
+    existing = {tuple(row) + ("",) * (len(ORDER_KEY_COLUMNS) - len(row)) for row in values}
+    new = [rec for rec in records if _order_key(rec) not in existing]
+    if new:
+        rows = [[rec.get(h, "") for h in headers] for rec in new]
+        _sheet_call_with_backoff("archive append", lambda: ws.append_rows(rows, value_input_option="RAW"))
+    return len(new)
+
+def _delete_sheet_rows(rows):
+    ws = get_sheet()
+    # bottom-up, so earlier deletions don't move the later ranges
+    reqs = [{"deleteDimension": {"range": {"sheetId": ws.id, "dimension": "ROWS",
+                                           "startIndex": first - 1, "endIndex": last}}}
+            for first, last in reversed(_row_runs(sorted(rows)))]
+    metrics.inc("sheets_calls_total", op="delete rows")
+    ws.spreadsheet.batch_update({"requests": reqs})
+
+def finish_pending_archive():
+    """Delete the sheet rows of an archive run the journal already committed. The batch
+    is applied atomically, so it is redone only while its first row still holds the
+    archived order (never retried blindly). True when nothing is pending."""
+    pending = order_journal.get_meta("archive_pending")
+    if not pending:
+        return True
+    first_row, first_key = pending["check"]
+    last_col = gspread.utils.rowcol_to_a1(1, len(ORDER_KEY_COLUMNS))[:-1]
+    try:
+        values = _sheet_call_with_backoff(
+            "archive check", lambda: get_sheet().get(f"A{first_row}:{last_col}{first_row}"))
+        current = [str(v) for v in (values[0] if values else [])]
+        if current == list(first_key):
+            _delete_sheet_rows(pending["rows"])
+        reload_sheet()   # the deletion shrank the grid; ws.row_count is cached
+    except Exception as e:
+        log(f"[Archive] deleting archived rows failed, will retry: {e}", "error", "sheet")
+        return False
+    order_journal.set_meta("archive_pending", None)
+    return True
+
+def _order_date(rec):
+    try:
+        return datetime.strptime(str(rec.get('Date', '')), "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return None
+
+def archive_closed_orders(now=None):
+    """Move closed orders older than the retention window to the archive; returns the
+    number of rows removed from the Signal sheet."""
+    cutoff = (now or datetime.now()) - timedelta(days=ARCHIVE_RETENTION_DAYS)
+    idx = ensure_order_index()
+    with idx.lock:
+        headers = list(idx.headers)
+        picked = []
+        for r, rec in sorted(idx.rows.items()):
+            dt = _order_date(rec)
+            if dt is not None and dt < cutoff and is_closed_result(rec.get('Result', '')):
+                picked.append((r, rec))
+    if len(picked) < ARCHIVE_MIN_ROWS:
+        return 0
+
+    by_month = {}
+    for _, rec in picked:
+        by_month.setdefault(rec['Date'][:7], []).append(rec)
+    written = sum(write_archive(month, headers, recs) for month, recs in sorted(by_month.items()))
+
+    # no flush runs in between, so the outbox is read either before or after renumbering
+    with _SHEET_FLUSH_LOCK, idx.lock:
+        # rows edited since the copy, or not on the sheet yet, wait for next time
+        unsent = order_journal.pending()[1]
+        removed = [r for r, rec in picked if idx.rows.get(r) is rec and r not in unsent]
+        if not removed:
+            return 0
+        check = [removed[0], list(_order_key(idx.rows[removed[0]]))]
+        mapping = idx.renumber(removed)
+        order_journal.archive(removed, mapping, {"rows": removed, "check": check})
+    flush_sheet_writes()   # deletes the rows, then replicates the renumbered outbox
+    metrics.inc("orders_archived_total", len(removed))
+    log(f"[Archive] moved {len(removed)} closed orders ({written} new in archive) out of {SHEET_NAME}", "info", "sheet")
+    return len(removed)
 
 # === ORDER EXPIRY ===
-def order_expired(order, expire_hr=4):
+ORDER_EXPIRE_HOURS = 4
+
+def order_expired(order, expire_hr=ORDER_EXPIRE_HOURS):
     dt_str = order.get('Date', '')
     try:
         dt = datetime.strptime(dt_str, "%Y-%m-%d %H:%M:%S")
@@ -352,203 +1451,869 @@ def build_entry_signal_message(order):
     )
     return msg
 
+# === MT5 SESSION ===
+# One long-lived terminal connection shared by the scan loop and the TP/SL thread,
+# instead of initialize()/shutdown() around every single request.
+MT5_HEALTH_CHECK_SEC   = 30.0  # ping terminal_info() at most this often while connected
+MT5_RECONNECT_RETRIES  = 3
+MT5_RECONNECT_BACKOFF  = 1.0   # seconds, doubled after each failed initialize()
+MT5_MAX_CONCURRENT_CALLS = 1   # `with mt5_session` blocks in flight at once (terminal IPC is not thread-safe)
+
+class MT5Session:
+    """Reference-counted MT5 connection with periodic health check and auto-reconnect.
+
+    Long-running owners (main loop, checker thread) call acquire() once; helpers use
+    `with mt5_session as ok:` around their requests. The terminal is only shut down
+    when the last reference is released. At most MT5_MAX_CONCURRENT_CALLS `with`
+    blocks run at once across threads (nested blocks in one thread don't count twice).
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._refs = 0
+        self._connected = False
+        self._last_check = 0.0
+        self._calls = threading.BoundedSemaphore(MT5_MAX_CONCURRENT_CALLS)
+        self._depth = threading.local()
+
+    def _connect(self):
+        backoff = MT5_RECONNECT_BACKOFF
+        for i in range(1, MT5_RECONNECT_RETRIES + 1):
+            metrics.inc("mt5_calls_total", call="initialize")
+            try:
+                if mt5.initialize():
+                    self._connected = True
+                    self._last_check = time.monotonic()
+                    return True
+                log(f"[MT5] initialize failed (try {i}): {mt5.last_error()}", "warning", "mt5")
+                metrics.inc("mt5_failures_total", call="initialize")
+            except Exception as e:
+                metrics.inc("mt5_failures_total", call="initialize")
+                log(f"[MT5] initialize error (try {i}): {e}", "warning", "mt5")
+            if i < MT5_RECONNECT_RETRIES:
+                time.sleep(backoff)
+                backoff *= 2.0
+        self._connected = False
+        return False
+
+    def _disconnect(self):
+        try:
+            mt5.shutdown()
+        except Exception:
+            pass
+        self._connected = False
+
+    def ensure(self):
+        """Return True if the terminal is usable, reconnecting when the health check fails."""
+        with self._lock:
+            if self._connected:
+                now = time.monotonic()
+                if now - self._last_check < MT5_HEALTH_CHECK_SEC:
+                    return True
+                metrics.inc("mt5_calls_total", call="terminal_info")
+                try:
+                    info = mt5.terminal_info()
+                except Exception:
+                    info = None
+                if info is not None:
+                    self._last_check = now
+                    return True
+                metrics.inc("mt5_failures_total", call="terminal_info")
+                log("[MT5] health check failed -> reconnecting", "warning", "mt5")
+                self._disconnect()
+            return self._connect()
+
+    def invalidate(self):
+        """Force a health check on next use (e.g. after a request returned nothing)."""
+        with self._lock:
+            self._last_check = 0.0
+
+    def acquire(self):
+        with self._lock:
+            self._refs += 1
+            return self.ensure()
+
+    def release(self):
+        with self._lock:
+            self._refs = max(0, self._refs - 1)
+            if self._refs == 0 and self._connected:
+                self._disconnect()
+
+    def __enter__(self):
+        depth = getattr(self._depth, "n", 0)
+        if depth == 0:
+            self._calls.acquire()
+        self._depth.n = depth + 1
+        try:
+            return self.acquire()
+        except BaseException:
+            self._exit_call()
+            raise
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.release()
+        finally:
+            self._exit_call()
+        return False
+
+    def _exit_call(self):
+        self._depth.n -= 1
+        if self._depth.n == 0:
+            self._calls.release()
+
+mt5_session = MT5Session()
+
+# === CANDLE CACHE ===
+# Per (symbol, timeframe) ring buffer: filled once, then topped up with only the bars
+# newer than the last cached one. The last slot is the still-forming bar and is
+# overwritten on every top-up, exactly like copy_rates_from_pos(..., 0, n) returns it.
+CANDLE_CACHE_BARS        = 500   # ring capacity per (symbol, timeframe)
+CANDLE_SYNC_MIN_INTERVAL = 1.0   # seconds; consumers within this window share one top-up
+TIMEFRAME_SECONDS = {
+    mt5.TIMEFRAME_M1: 60, mt5.TIMEFRAME_M5: 300, mt5.TIMEFRAME_M15: 900, mt5.TIMEFRAME_M30: 1800,
+    mt5.TIMEFRAME_H1: 3600, mt5.TIMEFRAME_H4: 14400, mt5.TIMEFRAME_D1: 86400,
+}
+TIMEFRAME_NAMES = {
+    mt5.TIMEFRAME_M1: "M1", mt5.TIMEFRAME_M5: "M5", mt5.TIMEFRAME_M15: "M15", mt5.TIMEFRAME_M30: "M30",
+    mt5.TIMEFRAME_H1: "H1", mt5.TIMEFRAME_H4: "H4", mt5.TIMEFRAME_D1: "D1",
+}
+
+# --- Timeframes ---
+# Only BASE_TIMEFRAME is downloaded for the strategy; higher timeframes that are whole
+# multiples of it (M30/H1/H4/D1 from M15) are resampled from its ring, so a trend
+# filter on H1/H4 costs no extra terminal round-trip.
+BASE_TIMEFRAME          = mt5.TIMEFRAME_M15
+SIGNAL_TIMEFRAME        = mt5.TIMEFRAME_M15   # bars the detectors/SL-TP/chart run on
+SIGNAL_BARS             = 100                 # SIGNAL_TIMEFRAME bars per scan and chart
+TREND_FILTER_TIMEFRAMES = ()                  # e.g. (mt5.TIMEFRAME_H1, mt5.TIMEFRAME_H4): EMA trend must agree
+TREND_FILTER_BARS       = 60                  # bars per filter timeframe (> EMA_PERIOD)
+CANDLE_DTYPE = np.dtype([
+    ('time', 'i8'), ('open', 'f8'), ('high', 'f8'), ('low', 'f8'), ('close', 'f8'),
+    ('tick_volume', 'u8'), ('spread', 'i4'),
+])
+
+def _to_candle_array(rates):
+    out = np.zeros(len(rates), dtype=CANDLE_DTYPE)
+    for name in CANDLE_DTYPE.names:
+        out[name] = rates[name]
+    return out
+
+class CandleRing:
+    """Fixed-capacity bar buffer. Every bar is written twice (slot and slot+capacity),
+    so the newest n bars are always one contiguous slice of `buf`."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buf = np.zeros(2 * capacity, dtype=CANDLE_DTYPE)
+        self.size = 0
+        self.head = 0          # next write slot in [0, capacity)
+        self.synced_at = 0.0   # time.monotonic() of the last successful top-up
+        self.lock = threading.Lock()
+
+    def tail(self, n):
+        n = min(n, self.size)
+        end = self.head + self.capacity
+        return self.buf[end - n:end]
+
+    def last_time(self):
+        return int(self.tail(1)['time'][0]) if self.size else None
+
+    def reset(self, bars):
+        bars = bars[-self.capacity:]
+        m = len(bars)
+        self.buf[:m] = bars
+        self.buf[self.capacity:self.capacity + m] = bars
+        self.size = m
+        self.head = m % self.capacity
+
+    def _write(self, slot, bar):
+        self.buf[slot] = bar
+        self.buf[slot + self.capacity] = bar
+
+    def push(self, bars):
+        """Merge bars (oldest first): same time as the last bar -> overwrite, newer -> append."""
+        for bar in bars:
+            last = self.last_time()
+            t = int(bar['time'])
+            if last is not None and t < last:
+                continue
+            if last is not None and t == last:
+                self._write((self.head - 1) % self.capacity, bar)
+                continue
+            self._write(self.head, bar)
+            self.head = (self.head + 1) % self.capacity
+            self.size = min(self.size + 1, self.capacity)
+
+_CANDLE_CACHE = {}
+_CANDLE_CACHE_LOCK = threading.Lock()
+
+def _resample_source(timeframe):
+    """BASE_TIMEFRAME if `timeframe` is built from it locally, else None (downloaded)."""
+    if timeframe == BASE_TIMEFRAME or timeframe not in TIMEFRAME_SECONDS:
+        return None
+    sec, base = TIMEFRAME_SECONDS[timeframe], TIMEFRAME_SECONDS[BASE_TIMEFRAME]
+    return BASE_TIMEFRAME if sec > base and sec % base == 0 else None
+
+def _ring_capacity(timeframe):
+    """Initial capacity: the base ring is deep enough for the deepest configured read
+    (SIGNAL_BARS or TREND_FILTER_BARS) of every timeframe resampled from it, plus the
+    partial bar. Deeper reads grow the ring (get_candle_ring)."""
+    cap = CANDLE_CACHE_BARS
+    if timeframe == BASE_TIMEFRAME:
+        bars = max(SIGNAL_BARS, TREND_FILTER_BARS)
+        for tf in (SIGNAL_TIMEFRAME,) + tuple(TREND_FILTER_TIMEFRAMES):
+            if _resample_source(tf) is not None:
+                ratio = TIMEFRAME_SECONDS[tf] // TIMEFRAME_SECONDS[BASE_TIMEFRAME]
+                cap = max(cap, (bars + 1) * ratio)
+    return cap
+
+def get_candle_ring(symbol, timeframe, min_bars=0):
+    """Ring of (symbol, timeframe). One holding fewer than `min_bars` is replaced by a
+    larger, empty ring, which the next sync reloads in full."""
+    k = (symbol, timeframe)
+    with _CANDLE_CACHE_LOCK:
+        ring = _CANDLE_CACHE.get(k)
+        if ring is None or ring.capacity < min_bars:
+            capacity = max(_ring_capacity(timeframe), min_bars)
+            if ring is not None:
+                log(f"[Candles] {symbol} {TIMEFRAME_NAMES.get(timeframe, timeframe)} ring grown "
+                    f"{ring.capacity} -> {capacity} bars", "info", "mt5")
+            ring = _CANDLE_CACHE[k] = CandleRing(capacity)
+        return ring
+
+def _sync_candle_ring(ring, symbol, timeframe, force=False):
+    """Top the ring up from MT5. Caller holds ring.lock. Returns False if no data at all."""
+    if ring.size and not force and time.monotonic() - ring.synced_at < CANDLE_SYNC_MIN_INTERVAL:
+        return True
+    with mt5_session as ok:
+        if not ok:
+            log(f"❌ MT5 Init Fail: {symbol}", "error", "mt5")
+            return ring.size > 0
+        last = ring.last_time()
+        if last is None:
+            metrics.inc("mt5_calls_total", call="copy_rates_from_pos")
+            rates = mt5.copy_rates_from_pos(symbol, timeframe, 0, ring.capacity)
+        else:
+            # normally only the forming bar (+ the one that just closed); widen on gaps
+            count = 2
+            while True:
+                metrics.inc("mt5_calls_total", call="copy_rates_from_pos")
+                rates = mt5.copy_rates_from_pos(symbol, timeframe, 0, count)
+                if rates is None or len(rates) < count or int(rates['time'][0]) <= last:
+                    break
+                if count >= ring.capacity:
+                    last = None  # gap larger than the ring -> reload
+                    break
+                count = min(count * 4, ring.capacity)
+    if rates is None or len(rates) == 0:
+        metrics.inc("mt5_failures_total", call="copy_rates_from_pos")
+        mt5_session.invalidate()
+        log(f"❌ MT5 Get Rates Fail: {symbol}", "error", "mt5")
+        return ring.size > 0
+    bars = _to_candle_array(rates)
+    if last is None:
+        ring.reset(bars)
+    else:
+        ring.push(bars)
+    ring.synced_at = time.monotonic()
+    return True
+
+def resample_rates(rates, seconds):
+    """Aggregate CANDLE_DTYPE bars into `seconds`-long bars on epoch multiples, i.e. on
+    the server clock like MT5's own H1/H4/D1. A first bucket the source only partly
+    covers is dropped; the last bucket is the forming bar, as in the ring."""
+    if len(rates) == 0:
+        return rates[:0].copy()
+    times = rates['time']
+    bucket = times // seconds * seconds
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], len(rates)] - 1
+    out = np.zeros(len(starts), dtype=CANDLE_DTYPE)
+    out['time'] = bucket[starts]
+    out['open'] = rates['open'][starts]
+    out['high'] = np.maximum.reduceat(rates['high'], starts)
+    out['low'] = np.minimum.reduceat(rates['low'], starts)
+    out['close'] = rates['close'][ends]
+    out['tick_volume'] = np.add.reduceat(rates['tick_volume'], starts)
+    out['spread'] = rates['spread'][ends]
+    if times[0] != bucket[0]:
+        out = out[1:]
+    return out
+
+def get_rates(symbol, timeframe, count):
+    """Newest `count` cached bars (structured CANDLE_DTYPE array, oldest first).
+    Timeframes built from BASE_TIMEFRAME are resampled from its ring."""
+    src = _resample_source(timeframe)
+    if src is not None:
+        ratio = TIMEFRAME_SECONDS[timeframe] // TIMEFRAME_SECONDS[src]
+        base = get_rates(symbol, src, (count + 1) * ratio)
+        return resample_rates(base, TIMEFRAME_SECONDS[timeframe])[-count:]
+    ring = get_candle_ring(symbol, timeframe, count)
+    with ring.lock:
+        if not _sync_candle_ring(ring, symbol, timeframe):
+            return ring.tail(0).copy()
+        return ring.tail(count).copy()
+
+def prime_candle_cache(symbols, timeframe):
+    timeframe = _resample_source(timeframe) or timeframe
+    for s in symbols:
+        ring = get_candle_ring(s, timeframe)
+        with ring.lock:
+            _sync_candle_ring(ring, s, timeframe, force=True)
+
+class Candles:
+    """Candle series backed by a CANDLE_DTYPE structured array (oldest first).
+
+    Columns are zero-copy views (c.close, c.high, ...); slicing returns another
+    Candles over the same memory and c[i] is a single bar record (c[-1]['close']).
+    """
+    __slots__ = ("rates",)
+
+    def __init__(self, rates):
+        self.rates = rates
+
+    def __len__(self):
+        return len(self.rates)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return Candles(self.rates[key])
+        return self.rates[key]
+
+    @property
+    def time(self):
+        return self.rates['time']
+
+    @property
+    def open(self):
+        return self.rates['open']
+
+    @property
+    def high(self):
+        return self.rates['high']
+
+    @property
+    def low(self):
+        return self.rates['low']
+
+    @property
+    def close(self):
+        return self.rates['close']
+
+    @property
+    def tick_volume(self):
+        return self.rates['tick_volume']
+
+    @property
+    def spread(self):
+        return self.rates['spread']
+
 # === PRICE / MT5 UTILS ===
 def get_candles(symbol, timeframe, count):
-    if not mt5.initialize():
-        log(f"❌ MT5 Init Fail: {symbol}", "error")
-        return []
-    rates = mt5.copy_rates_from_pos(symbol, timeframe, 0, count)
-    mt5.shutdown()
-    if rates is None or len(rates) == 0:
-        log(f"❌ MT5 Get Rates Fail: {symbol}", "error")
-        return []
-    return [{'open': r['open'], 'high': r['high'], 'low': r['low'], 'close': r['close']} for r in rates]
+    return Candles(get_rates(symbol, timeframe, count))
 
 def get_tick(symbol):
-    if not mt5.initialize():
-        log(f"❌ MT5 Init Fail: {symbol}", "error")
-        return None
-    tick = mt5.symbol_info_tick(symbol)
-    mt5.shutdown()
+    with mt5_session as ok:
+        if not ok:
+            log(f"❌ MT5 Init Fail: {symbol}", "error", "mt5")
+            return None
+        metrics.inc("mt5_calls_total", call="symbol_info_tick")
+        tick = mt5.symbol_info_tick(symbol)
+    if tick is None:
+        metrics.inc("mt5_failures_total", call="symbol_info_tick")
+        mt5_session.invalidate()
     return tick
 
+# === TICK SNAPSHOT ===
+# All SYMBOLS ticks are fetched in one pass and shared by every guard in check_symbol
+# and by the TP/SL checker, instead of one symbol_info_tick() per consumer.
+TICK_SNAPSHOT_MAX_AGE_SEC = 2.0   # reuse a snapshot younger than this
+SYMBOL_INDEX = {s: i for i, s in enumerate(SYMBOLS)}
+TICK_DTYPE = np.dtype([('time', 'i8'), ('bid', 'f8'), ('ask', 'f8')])
+Tick = namedtuple("Tick", "time bid ask")
+
+class TickSnapshot:
+    """Ticks for all SYMBOLS taken at one moment, stored by symbol index (time == 0 -> no tick)."""
+
+    def __init__(self, ticks, taken_at):
+        self.ticks = ticks
+        self.taken_at = taken_at
+
+    def age(self):
+        return time.monotonic() - self.taken_at
+
+    def get(self, symbol):
+        i = SYMBOL_INDEX.get(symbol)
+        if i is None:
+            # symbol outside SYMBOLS (e.g. an old row in the sheet) -> direct fetch
+            return get_tick(symbol)
+        t = self.ticks[i]
+        if t['time'] <= 0:
+            return None
+        return Tick(int(t['time']), float(t['bid']), float(t['ask']))
+
+_TICK_SNAPSHOT = None
+_TICK_SNAPSHOT_LOCK = threading.Lock()
+
+def take_tick_snapshot():
+    ticks = np.zeros(len(SYMBOLS), dtype=TICK_DTYPE)
+    with mt5_session as ok:
+        if not ok:
+            log("❌ MT5 Init Fail in take_tick_snapshot", "warning", "mt5")
+        else:
+            missing, newest = 0, 0.0
+            for i, s in enumerate(SYMBOLS):
+                t = mt5.symbol_info_tick(s)
+                if t is not None:
+                    ticks[i] = (int(t.time), float(t.bid), float(t.ask))
+                    newest = max(newest, (getattr(t, "time_msc", 0) / 1000.0) or t.time)
+                else:
+                    missing += 1
+            if newest:
+                server_clock.observe(newest)
+            metrics.inc("mt5_calls_total", len(SYMBOLS), call="symbol_info_tick")
+            if missing:
+                metrics.inc("mt5_failures_total", missing, call="symbol_info_tick")
+    return TickSnapshot(ticks, time.monotonic())
+
+def get_tick_snapshot(max_age=None):
+    """Shared snapshot, refreshed once it is older than max_age seconds."""
+    global _TICK_SNAPSHOT
+    if max_age is None:
+        max_age = TICK_SNAPSHOT_MAX_AGE_SEC
+    with _TICK_SNAPSHOT_LOCK:
+        snap = _TICK_SNAPSHOT
+        if snap is None or snap.age() > max_age:
+            snap = _TICK_SNAPSHOT = take_tick_snapshot()
+        return snap
+
 # Ensure all required symbols are visible in MT5 Market Watch
 def mt5_select_symbols(symbols):
-    if not mt5.initialize():
-        log("❌ MT5 Init Fail in mt5_select_symbols", "warning")
-        return
-    try:
+    with mt5_session as ok:
+        if not ok:
+            log("❌ MT5 Init Fail in mt5_select_symbols", "warning", "mt5")
+            return
         for s in symbols:
+            metrics.inc("mt5_calls_total", call="symbol_info")
             info = mt5.symbol_info(s)
             if info is None or not info.visible:
+                metrics.inc("mt5_calls_total", call="symbol_select")
                 mt5.symbol_select(s, True)
-    finally:
-        try:
-            mt5.shutdown()
-        except Exception:
-            pass
 
 # === Chart capture ===
-def capture_chart(symbol, entry, sl, tp1, tp2, tp3, bars=100):
-    candles = get_candles(symbol, mt5.TIMEFRAME_M15, bars)
-    if not candles:
-        return None
-
-    opens  = [c['open'] for c in candles]
-    closes = [c['close'] for c in candles]
-    highs  = [c['high'] for c in candles]
-    lows   = [c['low']  for c in candles]
-    n = len(candles)
-
-    fig, ax = plt.subplots(figsize=(10,5))
-
-    for i in range(n):
-        color = 'green' if closes[i] >= opens[i] else 'red'
-        ax.plot([i, i], [lows[i], highs[i]], color=color, linewidth=1)
-        lower = min(opens[i], closes[i])
-        height = abs(opens[i] - closes[i])
-        height = height if height > 1e-6 else 0.0001
-        ax.add_patch(plt.Rectangle((i-0.35, lower), 0.7, height, facecolor=color, edgecolor=color))
-
-    levels = {'Entry': entry, 'SL': sl, 'TP1': tp1, 'TP2': tp2, 'TP3': tp3}
-    colors = {'Entry': 'orange', 'SL': 'red', 'TP1': 'green', 'TP2': 'green', 'TP3': 'green'}
-    for label, price in levels.items():
-        ax.axhline(price, color=colors[label], linestyle='--', linewidth=1)
-        ax.text(n+0.8, price, f"{label} {price:.2f}", va='center', color=colors[label], fontsize=10)
-
-    ax.text(0.5, 0.5, "BTP", transform=ax.transAxes, fontsize=90, color='gray', alpha=0.15, ha='center', va='center', fontweight='bold')
+# Rendering lives in chart_render.py so a process pool can import it on its own.
+CHART_WORKERS         = 2      # render processes; 0 renders inline on the caller
+CHART_QUEUE_MAX       = 8      # queued + running jobs; more are dropped (the text still goes out)
+CHART_JOB_TIMEOUT_SEC = 20.0   # a job not finished by then is abandoned
+
+class ChartService:
+    """Chart rendering in a process pool, off the scan thread.
+
+    Workers pre-import matplotlib and draw once (chart_render.warm_up). submit() never
+    blocks: at most `max_jobs` jobs are queued or running, and a job that outlives
+    `timeout` resolves to None; if it was actually running, the pool is replaced so
+    the hung worker cannot hold up later charts.
+    """
+
+    def __init__(self, workers=CHART_WORKERS, max_jobs=CHART_QUEUE_MAX, timeout=CHART_JOB_TIMEOUT_SEC):
+        self.workers = workers
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max_jobs)
+        self.lock = threading.Lock()
+        self.pool = None
+
+    def start(self):
+        with self.lock:
+            if self.pool is None and self.workers > 0:
+                self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=chart_render.warm_up)
+            return self.pool
+
+    def _restart(self, pool):
+        with self.lock:
+            if self.pool is not pool:
+                return
+            self.pool = None
+        # shutdown() can't stop a running job, so the worker processes are killed;
+        # its other jobs then fail with BrokenProcessPool and resolve to None
+        procs = list((getattr(pool, "_processes", None) or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        for proc in procs:
+            try:
+                proc.terminate()
+            except Exception:
+                pass
 
-    for side in ['left','bottom','right','top']:
-        ax.spines[side].set_visible(False)
-    ax.get_xaxis().set_visible(False)
-    ax.get_yaxis().set_visible(False)
+    def submit(self, symbol, rates, levels, timeframe="M15"):
+        """Future of the PNG bytes (None if dropped, failed or timed out)."""
+        out = Future()
+        if not self.slots.acquire(blocking=False):
+            log(f"[Chart] queue full, no chart for {symbol}", "warning", "chart")
+            metrics.inc("chart_jobs_total", result="dropped")
+            out.set_result(None)
+            return out
+        t0 = time.perf_counter()
+        try:
+            pool = self.start()
+            if pool is None:
+                try:
+                    out.set_result(chart_render.render_chart(symbol, rates, levels, timeframe=timeframe))
+                finally:
+                    self.slots.release()
+                return out
+            job = pool.submit(chart_render.render_chart, symbol, rates, levels, timeframe=timeframe)
+        except Exception as e:
+            log(f"[Chart] render {symbol} failed: {e}", "warning", "chart")
+            self.slots.release()
+            if not out.done():
+                out.set_result(None)
+            return out
 
-    ax.set_xlim(-1, n+6)
-    ax.set_title(f"{symbol} M15 (Entry/SL/TP)")
+        def _resolve(png):
+            try:
+                out.set_result(png)
+            except InvalidStateError:
+                return  # already timed out
+            metrics.observe("chart_render_seconds", time.perf_counter() - t0)
+            metrics.inc("chart_jobs_total", result="ok" if png else "failed")
+
+        def _done(j):
+            self.slots.release()
+            try:
+                png = j.result()
+            except Exception as e:
+                log(f"[Chart] render {symbol} failed: {e!r}", "warning", "chart")
+                png = None
+            _resolve(png)
+
+        def _expire():
+            if job.done():
+                return
+            metrics.inc("chart_jobs_total", result="timeout")
+            _resolve(None)
+            if not job.cancel():
+                log(f"[Chart] render {symbol} exceeded {self.timeout:.0f}s, restarting chart pool", "warning", "chart")
+                self._restart(pool)
+
+        job.add_done_callback(_done)
+        timer = threading.Timer(self.timeout, _expire)
+        timer.daemon = True
+        timer.start()
+        return out
+
+chart_service = ChartService()
+
+def send_chart_photo(symbol, candles, levels, caption):
+    """Render in the chart pool and upload once ready; Future of the photo's message_id."""
+    out = Future()
+
+    def _rendered(job):
+        png = job.result()
+        if not png:
+            out.set_result(None)
+            return
+        sent = send_telegram_photo(png, caption=caption, parse_mode=None,
+                                   filename=f"chart_{symbol.replace('.', '_')}.png")
+        sent.add_done_callback(lambda f: out.set_result(f.result()))
 
-    img_path = f"chart_{symbol.replace('.', '_')}_{int(time.time())}.png"
-    plt.tight_layout()
-    plt.savefig(img_path, dpi=150, bbox_inches='tight')
-    plt.close(fig)
-    return img_path
+    tf_name = TIMEFRAME_NAMES[SIGNAL_TIMEFRAME]
+    chart_service.submit(symbol, candles.rates, levels, tf_name).add_done_callback(_rendered)
+    return out
 
 # === Trend/Pattern detectors ===
 def ema(arr, period):
-    """True EMA (exponential moving average)."""
+    """True EMA (exponential moving average), vectorized.
+
+    y[t] = beta^t * (y[0] + alpha * sum_k x[k] / beta^k) evaluated with cumsum in
+    chunks short enough that beta^-k stays well inside float range.
+    """
     arr = np.asarray(arr, dtype=float)
-    if len(arr) == 0:
+    n = len(arr)
+    if n == 0:
         return np.array([])
     # Seed with the first value to avoid lookback bias for short history
     alpha = 2.0 / (period + 1.0)
-    out = [arr[0]]
-    for x in arr[1:]:
-        out.append(alpha * x + (1 - alpha) * out[-1])
-    return np.array(out)
-
-def is_uptrend(closes):
-    if len(closes) < EMA_PERIOD:
-        return False
-    ema_val = ema(np.array(closes), EMA_PERIOD)
-    return closes[-1] > ema_val[-1]
-
-def is_downtrend(closes):
-    if len(closes) < EMA_PERIOD:
-        return False
-    ema_val = ema(np.array(closes), EMA_PERIOD)
-    return closes[-1] < ema_val[-1]
-
-def detect_engulfing(c):
-    if len(c) < 2: return None
-    prev, curr = c[-2], c[-1]
-    if prev['close'] < prev['open'] and curr['close'] > curr['open'] and curr['close'] > prev['open'] and curr['open'] < prev['close']:
-        return "Bullish Engulfing"
-    if prev['close'] > prev['open'] and curr['close'] < curr['open'] and curr['close'] < prev['open'] and curr['open'] > prev['close']:
-        return "Bearish Engulfing"
-    return None
+    beta = 1.0 - alpha
+    if beta <= 0.0:
+        return arr.copy()
+    chunk = max(1, min(1024, int(200.0 / -np.log(beta))))
+    out = np.empty(n)
+    out[0] = arr[0]
+    prev = arr[0]
+    for start in range(1, n, chunk):
+        x = arr[start:start + chunk]
+        pw = beta ** np.arange(1, len(x) + 1)
+        y = pw * (prev + alpha * np.cumsum(x / pw))
+        out[start:start + len(x)] = y
+        prev = y[-1]
+    return out
+
+# --- Incremental EMA per (symbol, timeframe, period) ---
+# Holds the EMA through the last *closed* bar; advanced in O(1) per new bar and
+# persisted so a restart does not need another warm-up.
+EMA_STATE_FILE = "ema_state.json"
+_EMA_STATE = {}  # "symbol|timeframe|period" -> {"time": bar epoch, "value": ema}
+_EMA_STATE_LOCK = threading.Lock()
+
+def load_ema_state(path=EMA_STATE_FILE):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        with _EMA_STATE_LOCK:
+            _EMA_STATE.update({k: {"time": int(v["time"]), "value": float(v["value"])} for k, v in data.items()})
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log(f"[EMA] cannot load {path}: {e}", "warning", "scan")
 
-def is_pinbar(c):
-    last = c[-1]
-    body = abs(last['close'] - last['open'])
-    upper_wick = last['high'] - max(last['close'], last['open'])
-    lower_wick = min(last['close'], last['open']) - last['low']
-    if upper_wick > 2 * body and upper_wick > lower_wick:
-        return "Pinbar Top"
-    if lower_wick > 2 * body and lower_wick > upper_wick:
-        return "Pinbar Bottom"
+def save_ema_state(path=EMA_STATE_FILE):
+    try:
+        with _EMA_STATE_LOCK:
+            data = json.dumps(_EMA_STATE)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except Exception as e:
+        log(f"[EMA] cannot save {path}: {e}", "warning", "scan")
+
+def closed_bar_ema(symbol, timeframe, candles, period=EMA_PERIOD):
+    """EMA through candles[-2] (the last closed bar)."""
+    key = f"{symbol}|{timeframe}|{period}"
+    times, closes = candles.time, candles.close
+    last_closed = int(times[-2])
+    with _EMA_STATE_LOCK:
+        st = _EMA_STATE.get(key)
+        if st is not None:
+            if st["time"] == last_closed:
+                return st["value"]
+            i = int(np.searchsorted(times, st["time"]))
+            if i < len(times) - 1 and int(times[i]) == st["time"]:
+                alpha = 2.0 / (period + 1.0)
+                v = st["value"]
+                for x in closes[i + 1:-1].tolist():
+                    v = alpha * x + (1 - alpha) * v
+                _EMA_STATE[key] = {"time": last_closed, "value": v}
+                return v
+        # first use or state too old for the cached history -> warm up once
+        v = float(ema(closes[:-1], period)[-1])
+        _EMA_STATE[key] = {"time": last_closed, "value": v}
+        return v
+
+def ema_trend(symbol, timeframe, candles, period=EMA_PERIOD):
+    """'up' / 'down' / 'none': last close against the EMA including the forming bar."""
+    if len(candles) < period:
+        return "none"
+    prev = closed_bar_ema(symbol, timeframe, candles, period)
+    alpha = 2.0 / (period + 1.0)
+    close = float(candles.close[-1])
+    cur = alpha * close + (1 - alpha) * prev
+    if close > cur:
+        return "up"
+    if close < cur:
+        return "down"
+    return "none"
+
+def trend_filter_conflict(symbol, trend):
+    """Name of the first TREND_FILTER_TIMEFRAMES whose EMA trend is not `trend`, else None.
+    Those timeframes are resampled from the cached base bars (no MT5 request)."""
+    for tf in TREND_FILTER_TIMEFRAMES:
+        if ema_trend(symbol, tf, get_candles(symbol, tf, TREND_FILTER_BARS)) != trend:
+            return TIMEFRAME_NAMES.get(tf, str(tf))
     return None
 
-def is_double_top(c):
-    if len(c) < 5: return False
-    a, b, c1, d, e = c[-5], c[-4], c[-3], c[-2], c[-1]
-    return (a['high'] < b['high'] and b['high'] > c1['high'] and d['high'] < b['high'] and abs(b['high'] - d['high']) < 0.002 * b['high'] and e['close'] < d['low'])
-
-def is_double_bottom(c):
-    if len(c) < 5: return False
-    a, b, c1, d, e = c[-5], c[-4], c[-3], c[-2], c[-1]
-    return (a['low'] > b['low'] and b['low'] < c1['low'] and d['low'] > b['low'] and abs(b['low'] - d['low']) < 0.002 * b['low'] and e['close'] > d['high'])
-
-def is_morning_star(c):
-    if len(c) < 3: return False
-    return (c[-3]['close'] < c[-3]['open'] and c[-2]['low'] < c[-3]['close'] and abs(c[-2]['close'] - c[-2]['open']) < abs(c[-1]['close'] - c[-1]['open']) and c[-1]['close'] > c[-1]['open'] and c[-1]['close'] > c[-3]['open'])
-
-def is_evening_star(c):
-    if len(c) < 3: return False
-    return (c[-3]['close'] > c[-3]['open'] and c[-2]['high'] > c[-3]['close'] and abs(c[-2]['close'] - c[-2]['open']) < abs(c[-1]['close'] - c[-1]['open']) and c[-1]['close'] < c[-1]['open'] and c[-1]['close'] < c[-3]['open'])
-
-def detect_qm(c):
-    if len(c) < 5: return None
-    h1 = c[-5]['high']; l1 = c[-4]['low']; h2 = c[-3]['high']; l2 = c[-2]['low']; h3 = c[-1]['high']
-    if l1 < l2 and h2 > h1 and l2 < l1 and h3 > h2: return "QM Buy"
-    if h1 > h2 and l2 > l1 and h3 < h2 and l2 > l1: return "QM Sell"
-    return None
+# --- Pattern engine ---
+# Detectors register once with (name, direction, lookback) and read shared columns
+# from CandleFeatures. Registration order is the priority order check_symbol uses.
+# Detectors stick to elementwise numpy ops (&, |, np.abs, np.maximum) so they work
+# on any bar window, not only on the last bar.
+PatternDetector = namedtuple("PatternDetector", "name direction lookback func")
+PATTERN_DETECTORS = []
+
+def register_pattern(name, direction, lookback):
+    def deco(func):
+        PATTERN_DETECTORS.append(PatternDetector(name, direction, lookback, func))
+        return func
+    return deco
+
+class CandleFeatures:
+    """Columns shared by all detectors: o/h/l/c plus body, upper/lower wick and range."""
+
+    def __init__(self, candles):
+        self.n = len(candles)
+        self.o, self.h, self.l, self.c = candles.open, candles.high, candles.low, candles.close
+        self.body  = np.abs(self.c - self.o)
+        self.upper = self.h - np.maximum(self.o, self.c)
+        self.lower = np.minimum(self.o, self.c) - self.l
+        self.range = self.h - self.l
+
+class PatternResult:
+    """Detectors that fired on the last bar, in priority order."""
+
+    def __init__(self, hits):
+        self.hits = hits
+
+    @property
+    def names(self):
+        return [d.name for d in self.hits]
+
+    def first(self, direction):
+        """Highest-priority pattern for 'Buy'/'Sell', or None."""
+        for d in self.hits:
+            if d.direction == direction:
+                return d.name
+        return None
 
-def detect_imbalance(c):
-    last = c[-1]
-    body = abs(last['close'] - last['open'])
-    wick = last['high'] - last['low']
-    return body / wick > 0.7 if wick > 0 else False
-
-def detect_demand_zone(candles):
-    if len(candles) < 10: return False
-    base = candles[-6:-1]
-    last = candles[-1]
-    base_high = max(c['high'] for c in base)
-    base_low  = min(c['low']  for c in base)
-    is_base = all(abs(c['close'] - c['open']) < (base_high - base_low)/2 for c in base)
-    return is_base and last['close'] > base_high and last['close'] > last['open']
-
-def detect_supply_zone(candles):
-    if len(candles) < 10: return False
-    base = candles[-6:-1]
-    last = candles[-1]
-    base_high = max(c['high'] for c in base)
-    base_low  = min(c['low']  for c in base)
-    is_base = all(abs(c['close'] - c['open']) < (base_high - base_low)/2 for c in base)
-    return is_base and last['close'] < base_low and last['close'] < last['open']
-
-def find_zone_levels(candles, entry, direction):
-    highs, lows = [], []
-    for i in range(2, len(candles)-2):
-        if (candles[i]['high'] > candles[i-2]['high'] and candles[i]['high'] > candles[i-1]['high'] and candles[i]['high'] > candles[i+1]['high'] and candles[i]['high'] > candles[i+2]['high']):
-            highs.append(candles[i]['high'])
-        if (candles[i]['low'] < candles[i-2]['low'] and candles[i]['low'] < candles[i-1]['low'] and candles[i]['low'] < candles[i+1]['low'] and candles[i]['low'] < candles[i+2]['low']):
-            lows.append(candles[i]['low'])
-    dmz, spz = [], []
-    for i in range(6, len(candles)):
-        base = candles[i-6:i-1]
-        last = candles[i-1]
-        base_high = max(c['high'] for c in base)
-        base_low  = min(c['low']  for c in base)
-        is_base = all(abs(c['close']-c['open']) < (base_high-base_low)/2 for c in base)
-        if is_base and last['close'] > base_high and last['close'] > last['open']:
-            dmz.append(base_low)
-        if is_base and last['close'] < base_low and last['close'] < last['open']:
-            spz.append(base_high)
-    if direction == "Buy":
-        levels = sorted([z for z in highs + dmz if z > entry])
+def detect_patterns(candles, detectors=None):
+    detectors = PATTERN_DETECTORS if detectors is None else detectors
+    need = max((d.lookback for d in detectors), default=0)
+    f = CandleFeatures(candles[-need:] if need else candles)
+    hits, seen = [], {}
+    for d in detectors:
+        if f.n < d.lookback:
+            continue
+        fired = seen.get(d.func)
+        if fired is None:
+            fired = seen[d.func] = bool(d.func(f))
+        if fired:
+            hits.append(d)
+    return PatternResult(hits)
+
+@register_pattern("Bullish Engulfing", "Buy", 2)
+def _bullish_engulfing(f):
+    o, c = f.o, f.c
+    return (c[-2] < o[-2]) & (c[-1] > o[-1]) & (c[-1] > o[-2]) & (o[-1] < c[-2])
+
+@register_pattern("Bearish Engulfing", "Sell", 2)
+def _bearish_engulfing(f):
+    o, c = f.o, f.c
+    return (c[-2] > o[-2]) & (c[-1] < o[-1]) & (c[-1] < o[-2]) & (o[-1] > c[-2])
+
+@register_pattern("Pinbar Bottom", "Buy", 1)
+def _pinbar_bottom(f):
+    return (f.lower[-1] > 2 * f.body[-1]) & (f.lower[-1] > f.upper[-1])
+
+@register_pattern("Pinbar Top", "Sell", 1)
+def _pinbar_top(f):
+    return (f.upper[-1] > 2 * f.body[-1]) & (f.upper[-1] > f.lower[-1])
+
+@register_pattern("Double Top", "Sell", 5)
+def _double_top(f):
+    h = f.h
+    return ((h[-5] < h[-4]) & (h[-4] > h[-3]) & (h[-2] < h[-4])
+            & (np.abs(h[-4] - h[-2]) < 0.002 * h[-4]) & (f.c[-1] < f.l[-2]))
+
+@register_pattern("Double Bottom", "Buy", 5)
+def _double_bottom(f):
+    l = f.l
+    return ((l[-5] > l[-4]) & (l[-4] < l[-3]) & (l[-2] > l[-4])
+            & (np.abs(l[-4] - l[-2]) < 0.002 * l[-4]) & (f.c[-1] > f.h[-2]))
+
+@register_pattern("Morning Star", "Buy", 3)
+def _morning_star(f):
+    o, c = f.o, f.c
+    return ((c[-3] < o[-3]) & (f.l[-2] < c[-3]) & (f.body[-2] < f.body[-1])
+            & (c[-1] > o[-1]) & (c[-1] > o[-3]))
+
+@register_pattern("Evening Star", "Sell", 3)
+def _evening_star(f):
+    o, c = f.o, f.c
+    return ((c[-3] > o[-3]) & (f.h[-2] > c[-3]) & (f.body[-2] < f.body[-1])
+            & (c[-1] < o[-1]) & (c[-1] < o[-3]))
+
+@register_pattern("Quasimodo Buy", "Buy", 5)
+def _qm_buy(f):
+    h1, l1, h2, l2, h3 = f.h[-5], f.l[-4], f.h[-3], f.l[-2], f.h[-1]
+    return (l1 < l2) & (h2 > h1) & (l2 < l1) & (h3 > h2)
+
+@register_pattern("Quasimodo Sell", "Sell", 5)
+def _qm_sell(f):
+    h1, l1, h2, l2, h3 = f.h[-5], f.l[-4], f.h[-3], f.l[-2], f.h[-1]
+    return (h1 > h2) & (l2 > l1) & (h3 < h2) & (l2 > l1)
+
+def _imbalance(f):
+    rng = f.range[-1]
+    return (rng > 0) & (f.body[-1] / np.where(rng > 0, rng, 1.0) > 0.7)
+
+register_pattern("Imbalance Up", "Buy", 1)(_imbalance)
+register_pattern("Imbalance Down", "Sell", 1)(_imbalance)
+
+def _base_breakout(f):
+    """(base_high, base_low, is_base) of the 5 bars before the last one."""
+    base_high = np.maximum.reduce([f.h[-k] for k in range(2, 7)])
+    base_low  = np.minimum.reduce([f.l[-k] for k in range(2, 7)])
+    half = (base_high - base_low) / 2
+    is_base = np.logical_and.reduce([f.body[-k] < half for k in range(2, 7)])
+    return base_high, base_low, is_base
+
+@register_pattern("Demand Zone", "Buy", 10)
+def _demand_zone(f):
+    base_high, _, is_base = _base_breakout(f)
+    return is_base & (f.c[-1] > base_high) & (f.c[-1] > f.o[-1])
+
+@register_pattern("Supply Zone", "Sell", 10)
+def _supply_zone(f):
+    _, base_low, is_base = _base_breakout(f)
+    return is_base & (f.c[-1] < base_low) & (f.c[-1] < f.o[-1])
+
+# --- Zone levels (swing pivots + base/breakout zones) ---
+_ZONE_CACHE = {}        # (symbol, bar time, direction, ...) -> sorted candidate levels
+_ZONE_CACHE_MAX = 256
+_ZONE_CACHE_LOCK = threading.Lock()
+
+def _zone_candidates(candles, direction):
+    """All zone levels for one direction, sorted ascending (not yet filtered by entry).
+
+    Buy  -> 5-bar swing highs + demand-zone base lows
+    Sell -> 5-bar swing lows  + supply-zone base highs
+    """
+    o, h, l, cl = candles.open, candles.high, candles.low, candles.close
+    n = len(candles)
+    parts = []
+    if n >= 5:
+        # pivot: bar i beats i-2, i-1, i+1, i+2 (window centre = column 2)
+        col = h if direction == "Buy" else l
+        w = sliding_window_view(col, 5)
+        centre, others = w[:, 2], w[:, [0, 1, 3, 4]]
+        if direction == "Buy":
+            pivots = (centre[:, None] > others).all(axis=1)
+        else:
+            pivots = (centre[:, None] < others).all(axis=1)
+        parts.append(centre[pivots])
+    if n >= 7:
+        # base = 5 bars [j, j+5), breakout bar = j+5 (the forming bar is never a breakout)
+        base_high = sliding_window_view(h[:n-2], 5).max(axis=1)
+        base_low  = sliding_window_view(l[:n-2], 5).min(axis=1)
+        body      = sliding_window_view(np.abs(cl[:n-2] - o[:n-2]), 5)
+        is_base   = (body < ((base_high - base_low) / 2)[:, None]).all(axis=1)
+        last_o, last_c = o[5:n-1], cl[5:n-1]
+        if direction == "Buy":
+            parts.append(base_low[is_base & (last_c > base_high) & (last_c > last_o)])
+        else:
+            parts.append(base_high[is_base & (last_c < base_low) & (last_c < last_o)])
+    if not parts:
+        return np.array([])
+    return np.sort(np.concatenate(parts))
+
+def find_zone_levels(candles, entry, direction, symbol=None):
+    """Zone levels beyond entry, nearest first. Memoized per (symbol, bar time, direction)
+    when a symbol is given, so check_symbol and calculate_sl_tp share one scan."""
+    if symbol is not None and len(candles):
+        key = (symbol, int(candles.time[-1]), direction, len(candles),
+               float(candles.high[-1]), float(candles.low[-1]))
+        with _ZONE_CACHE_LOCK:
+            cand = _ZONE_CACHE.get(key)
+        if cand is None:
+            cand = _zone_candidates(candles, direction)
+            with _ZONE_CACHE_LOCK:
+                _ZONE_CACHE[key] = cand
+                while len(_ZONE_CACHE) > _ZONE_CACHE_MAX:
+                    del _ZONE_CACHE[next(iter(_ZONE_CACHE))]
     else:
-        levels = sorted([z for z in lows + spz if z < entry], reverse=True)
-    return levels
+        cand = _zone_candidates(candles, direction)
+    if direction == "Buy":
+        return cand[cand > entry].tolist()
+    return cand[cand < entry][::-1].tolist()
 
 # === MARKET GUARD HELPERS ===
 LAST_BAR_TIME = {}  # key=(symbol, timeframe) -> epoch time of last bar
@@ -559,7 +2324,7 @@ def is_forex_symbol(symbol: str) -> bool:
 def is_crypto_symbol(symbol: str) -> bool:
     return symbol in CRYPTO_SYMBOLS
 
-def is_market_open(symbol: str) -> bool:
+def is_market_open(symbol: str, snapshot=None) -> bool:
 
     if not MARKET_GUARD_ENABLED:
         return True
@@ -577,12 +2342,7 @@ def is_market_open(symbol: str) -> bool:
             return False
 
     # Tick freshness guard (all symbols)
-# Tick freshness guard (all symbols)
-    if not mt5.initialize():
-        log("❌ MT5 Init Fail in is_market_open", "warning")
-        return False
-    tick = mt5.symbol_info_tick(symbol)
-    mt5.shutdown()
+    tick = (snapshot or get_tick_snapshot()).get(symbol)
     if not tick:
         return False
     age_sec = datetime.now(timezone.utc).timestamp() - float(tick.time)
@@ -593,12 +2353,8 @@ def is_market_open(symbol: str) -> bool:
 
 def has_new_bar(symbol: str, timeframe) -> bool:
     """Return True only when a new bar appears in MT5 for the symbol/timeframe."""
-    if not mt5.initialize():
-        log("❌ MT5 Init Fail in has_new_bar", "warning")
-        return False
-    rates = mt5.copy_rates_from_pos(symbol, timeframe, 0, 2)
-    mt5.shutdown()
-    if rates is None or len(rates) < 2:
+    rates = get_rates(symbol, timeframe, 2)
+    if len(rates) < 2:
         return False
     last_time = int(rates[-1]['time'])  # epoch seconds
     k = (symbol, timeframe)
@@ -644,7 +2400,9 @@ def in_session_local(symbol: str, dt_local: datetime) -> bool:
     return False
 
 # === SL/TP CALC ===
-def calculate_sl_tp(symbol, entry, candles, direction):
+def calculate_sl_tp(symbol, entry, candles, direction, tick=None, rng=None):
+    """SL and [TP1, TP2, TP3] for an entry. `rng` (random.Random) drives the SL
+    offset; the backtester passes a seeded one."""
     digits = symbol_digits.get(symbol, 2)
 
     offset_map = {
@@ -666,16 +2424,16 @@ def calculate_sl_tp(symbol, entry, candles, direction):
     }
 
     sl_range = offset_map.get(symbol, (0.002, 0.003))
-    sl_offset = random.uniform(*sl_range)
+    sl_offset = (rng or random).uniform(*sl_range)
     min_gap = min_gap_map.get(symbol, 0.0002)
 
-    zones = find_zone_levels(candles, entry, direction)
+    zones = find_zone_levels(candles, entry, direction, symbol=symbol)
 
     if direction == "Buy":
-        swl_candidates = [z for z in [c['low'] for c in candles[-7:-2]] + zones if z < entry]
+        swl_candidates = [z for z in candles.low[-7:-2].tolist() + zones if z < entry]
         sl = min(swl_candidates) - sl_offset if swl_candidates else entry - sl_offset * 3
     else:
-        swh_candidates = [z for z in [c['high'] for c in candles[-7:-2]] + zones if z > entry]
+        swh_candidates = [z for z in candles.high[-7:-2].tolist() + zones if z > entry]
         sl = max(swh_candidates) + sl_offset if swh_candidates else entry + sl_offset * 3
 
     # dedupe/space zones by min_gap
@@ -724,13 +2482,14 @@ def calculate_sl_tp(symbol, entry, candles, direction):
     if not (side_ok and gap_ok and value_ok):
         # --- ATR fallback ---
         if FALLBACK_USE_ATR:
-            atr = get_atr(symbol, mt5.TIMEFRAME_M15)
+            atr = get_atr(symbol, SIGNAL_TIMEFRAME, rates=candles.rates)
             if atr is None:
                 raise Exception(f"SL/TP validation failed and ATR missing -> entry={entry}, sl={sl}, tp1={tp1}, tp2={tp2}, tp3={tp3}")
             mult = ATR_MULT.get(symbol, 1.0)
             sl_dist = max(atr*mult, 6 * (10 ** (-digits)))
             # add spread buffer
-            tick = get_tick(symbol)
+            if tick is None:
+                tick = get_tick_snapshot().get(symbol)
             spr_pts = (float(tick.ask) - float(tick.bid)) / (10 ** (-digits)) if tick else 0.0
             sl_buffer = spr_pts * (10 ** (-digits))
             if direction == "Buy":
@@ -754,13 +2513,10 @@ def calculate_sl_tp(symbol, entry, candles, direction):
     return sl, [tp1, tp2, tp3]
 
 # ATR helper
-def get_atr(symbol, timeframe, period=14):
-    if not mt5.initialize():
-        log("❌ MT5 Init Fail in get_atr", "warning")
-        return None
-    rates = mt5.copy_rates_from_pos(symbol, timeframe, 0, period+1)
-    mt5.shutdown()
-    if rates is None or len(rates) < period+1:
+def get_atr(symbol, timeframe, period=14, rates=None):
+    """Simple-average ATR of the newest bars (from the candle cache unless `rates` is given)."""
+    rates = get_rates(symbol, timeframe, period+1) if rates is None else rates[-(period+1):]
+    if len(rates) < period+1:
         return None
     tr = []
     for i in range(1, len(rates)):
@@ -768,33 +2524,150 @@ def get_atr(symbol, timeframe, period=14):
         tr.append(max(h-l, abs(h-c1), abs(l-c1)))
     return sum(tr)/len(tr)
 
+# extra validation layer (applied by check_symbol after calculate_sl_tp)
+MIN_GAP_MAP2 = {
+    "EURUSD.A": 0.0012, "GBPUSD.A": 0.0020, "AUDUSD.A": 0.0012, "NZDUSD.A": 0.0012,
+    "EURGBP.A": 0.0010, "USDCAD.A": 0.0015, "USDJPY.A": 0.10, "XAUUSD.A": 0.5,
+    "NAS100.A": 20, "US30.A": 50, "BTCUSD.A": 50
+}
+
+def signal_levels_ok(symbol, entry, sl, tp1, tp2, tp3):
+    min_gap2 = MIN_GAP_MAP2.get(symbol, 0.0002)
+    for v in [sl, tp1, tp2, tp3]:
+        if v is None or v == 0 or abs(entry - v) < min_gap2 or v == entry:
+            return False
+    return True
+
 # === SIGNAL DUPLICATE CHECK ===
 def check_symbol_for_new_signal(symbol):
-    records = get_all_sheet_records_with_retry()
-    now = datetime.now()
-    for r in records[::-1]:
-        if r.get('Symbol', '') == symbol:
-            try:
-                last_dt = datetime.strptime(r['Date'], "%Y-%m-%d %H:%M:%S")
-                if (now - last_dt).total_seconds() < 1800:  # 30 นาที
-                    return False
-            except:
-                pass
-            break
+    r = ensure_order_index().last_for_symbol(symbol)
+    if r is not None:
+        try:
+            last_dt = datetime.strptime(r['Date'], "%Y-%m-%d %H:%M:%S")
+            if (datetime.now() - last_dt).total_seconds() < 1800:  # 30 นาที
+                return False
+        except:
+            pass
     return True
 
-# === M15 close waiter ===
-def wait_for_m15_close():
-    while True:
-        now = datetime.now()
-        if now.minute % 15 == 0 and now.second < 10:
-            break
-        time.sleep(5)
-    log("ถึงเวลา M15 close")
+# === BAR CLOSE SCHEDULER ===
+# Bar boundaries come from broker server time, estimated from tick timestamps (MT5 tick
+# times are server-time epochs, usually a few hours off local time). The scheduler
+# sleeps until the next boundary + BAR_SETTLE_DELAY_SEC and runs the jobs registered
+# for every timeframe that just closed.
+BAR_SETTLE_DELAY_SEC    = 1.5     # after the boundary, so MT5 has opened the new bar
+BAR_MAX_SLEEP_SEC       = 30.0    # re-check the target at least this often
+SERVER_CLOCK_WINDOW_SEC = 900.0   # offset = largest tick sample in this window
+
+class ServerClock:
+    """Broker server time = local wall clock + offset.
+
+    A tick is never newer than the server's "now", so every (tick time - wall time)
+    sample is a lower bound of the offset; the largest one seen within `window` seconds
+    is used. Only ticks newer than the last one observed count, so while the market
+    is closed (frozen tick times) the last offset is kept.
+    """
+
+    def __init__(self, window=SERVER_CLOCK_WINDOW_SEC):
+        self.window = window
+        self.samples = deque()   # (wall, offset), offsets decreasing
+        self.offset = None
+        self.last_tick = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, tick_time, wall=None):
+        wall = time.time() if wall is None else wall
+        sample = tick_time - wall
+        with self.lock:
+            if tick_time <= self.last_tick:
+                return
+            self.last_tick = tick_time
+            while self.samples and self.samples[-1][1] <= sample:
+                self.samples.pop()
+            self.samples.append((wall, sample))
+            while wall - self.samples[0][0] > self.window:
+                self.samples.popleft()
+            self.offset = self.samples[0][1]
+
+    def now(self):
+        return time.time() + (self.offset or 0.0)
+
+    def to_wall(self, server_ts):
+        return server_ts - (self.offset or 0.0)
+
+server_clock = ServerClock()
+metrics.gauge("server_clock_offset_seconds", lambda: server_clock.offset or 0.0,
+              "broker server time minus local time, from ticks")
+
+class BarCloseScheduler:
+    """Runs fn(bar_open_time) for each registered timeframe once per closed bar.
+
+    The first pass only records the current bar, like the old M15 waiter, so nothing
+    fires for a bar that closed before start-up. If a pass comes late enough that
+    boundaries were skipped (long job, machine asleep), they are counted as missed
+    and the jobs run once for the newest boundary.
+    """
+
+    def __init__(self, clock, settle=BAR_SETTLE_DELAY_SEC):
+        self.clock = clock
+        self.settle = settle
+        self.jobs = {}   # timeframe -> [fn]
+        self.last = {}   # timeframe -> server epoch of the last handled boundary
+
+    def every(self, timeframe, fn):
+        self.jobs.setdefault(timeframe, []).append(fn)
+
+    def next_boundary(self):
+        now = self.clock.now()
+        return min((int(now // TIMEFRAME_SECONDS[tf]) + 1) * TIMEFRAME_SECONDS[tf] for tf in self.jobs)
+
+    def wait(self):
+        """Sleep until the next boundary (server time) + settle delay."""
+        target = self.next_boundary()
+        while True:
+            # the offset may be refined by new ticks while sleeping
+            remaining = self.clock.to_wall(target) + self.settle - time.time()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, BAR_MAX_SLEEP_SEC))
+
+    def run_pending(self):
+        for tf, fns in self.jobs.items():
+            period = TIMEFRAME_SECONDS[tf]
+            name = TIMEFRAME_NAMES.get(tf, str(tf))
+            boundary = int(self.clock.now() // period) * period
+            last = self.last.get(tf)
+            if last is not None and boundary <= last:
+                continue
+            self.last[tf] = boundary
+            if last is None:
+                continue
+            missed = (boundary - last) // period - 1
+            if missed > 0:
+                metrics.inc("bar_close_missed_total", missed, tf=name)
+                log(f"[Scheduler] {name}: {missed} bar close(s) missed", "warning")
+            delay = self.clock.now() - boundary
+            metrics.observe("bar_close_delay_seconds", delay, tf=name)
+            log(f"[Scheduler] {name} close {datetime.fromtimestamp(boundary, timezone.utc):%H:%M} "
+                f"(server) +{delay:.2f}s")
+            for fn in fns:
+                t0 = time.perf_counter()
+                try:
+                    fn(boundary)
+                except Exception as e:
+                    log(f"[Scheduler] {name} job {fn.__name__} failed: {e}\n{traceback.format_exc()}", "error")
+                metrics.observe("bar_job_seconds", time.perf_counter() - t0, tf=name)
 
 # === DAILY/WEEKLY SUMMARY ===
+# Checked on every SUMMARY_TIMEFRAME close by its own scheduler job (local time), so a
+# slow signal scan can delay a summary but not skip it.
+SUMMARY_TIMEFRAME = mt5.TIMEFRAME_M5
+SUMMARY_GRACE_MIN = 60   # a summary still goes out this many minutes after its time
+_last_daily_summary = None    # date string of the last daily summary sent
+_last_weekly_summary = None   # monday-of-week string of the last weekly summary sent
+
 def summarize_results_daily():
-    records = get_all_sheet_records_with_retry()
+    records = ensure_order_index().records()
     today = datetime.now().strftime("%Y-%m-%d")
     orders = [r for r in records if r['Date'].startswith(today)]
     win    = sum(1 for o in orders if str(o['Result']).startswith('TP'))
@@ -810,11 +2683,11 @@ def summarize_results_daily():
 ----------------------------
 
 *ข้อมูลโดย Begintopro*"""
-    send_telegram_message(msg)
+    send_telegram_message(msg, priority=TG_PRIORITY_SUMMARY)
     log_daily_summary_to_sheet(today, len(orders), win, loss, expire)
 
 def summarize_results_weekly():
-    records = get_all_sheet_records_with_retry()
+    records = ensure_order_index().records()
     now = datetime.now()
     week_start = (now - timedelta(days=now.weekday())).strftime("%Y-%m-%d")
     week_end   = (now + timedelta(days=6-now.weekday())).strftime("%Y-%m-%d")
@@ -832,22 +2705,37 @@ def summarize_results_weekly():
 ----------------------------
 
 *ข้อมูลโดย Begintopro*"""
-    send_telegram_message(msg)
+    send_telegram_message(msg, priority=TG_PRIORITY_SUMMARY)
+
+def _summary_due(now, at):
+    return at <= now < at + timedelta(minutes=SUMMARY_GRACE_MIN)
+
+def on_summary_bar_close(bar_time, now=None):
+    """Daily summary at 23:00 and weekly (Mon) at 08:00, each sent once per period."""
+    global _last_daily_summary, _last_weekly_summary
+    now = now or datetime.now()
+    today = now.strftime("%Y-%m-%d")
+    if _summary_due(now, now.replace(hour=23, minute=0, second=0, microsecond=0)) and _last_daily_summary != today:
+        summarize_results_daily()
+        _last_daily_summary = today
+        log(f"[Scheduler] Daily summary sent for {today}", "info")
+
+    monday_of_week = (now - timedelta(days=now.weekday())).strftime("%Y-%m-%d")
+    if (now.weekday() == 0 and _summary_due(now, now.replace(hour=8, minute=0, second=0, microsecond=0))
+            and _last_weekly_summary != monday_of_week):
+        summarize_results_weekly()
+        _last_weekly_summary = monday_of_week
+        log(f"[Scheduler] Weekly summary sent for week starting {monday_of_week}", "info")
 
 # === LOCK HELPERS ===
 def has_running_order_for_symbol(symbol: str) -> bool:
-    records = get_all_sheet_records_with_retry()
-    for r in records:
-        if r.get('Symbol', '') == symbol and not is_closed_result(r.get('Result', '')):
-            return True
-    return False
+    return ensure_order_index().has_open(symbol)
 
 def has_any_running_order() -> bool:
-    records = get_all_sheet_records_with_retry()
-    return any(not is_closed_result(r.get('Result', '')) for r in records)
+    return ensure_order_index().has_open()
 
 # === ORDER STATUS CHECKER (thread) ===
-def check_order_status(order, digits):
+def check_order_status(order, digits, snapshot=None):
     symbol = order.get('Symbol', '')
     entry  = get_float_safe(order, 'Entry')
     sl     = get_float_safe(order, 'SL')
@@ -855,7 +2743,7 @@ def check_order_status(order, digits):
     tp2    = get_float_safe(order, 'TP2')
     tp3    = get_float_safe(order, 'TP3')
     direction = order.get('Direction', '')
-    tick   = get_tick(symbol)
+    tick   = (snapshot or get_tick_snapshot()).get(symbol)
     if not tick or any(x is None for x in [entry, sl, tp1, tp2, tp3]):
         return "Running"
     price = float(tick.bid) if direction == "Buy" else float(tick.ask)
@@ -872,174 +2760,371 @@ def check_order_status(order, digits):
         if tp1 and price <= tp1: return "TP1"
     return "Running"
 
+# --- Price-level trigger index ---
+# Besides the current bid/ask, each pass also looks at the M1 high/low since the
+# previous pass, so a spike through SL/TP that reverses between polls still counts.
+TP_SL_CHECK_INTERVAL_SEC = 5.0          # poll interval; bar ranges cover the gaps
+RANGE_CHECK_TIMEFRAME    = mt5.TIMEFRAME_M1
+RANGE_CHECK_BARS         = 30           # max M1 bars one pass may look back
+
+class TriggerIndex:
+    """Open orders' SL/TP1/TP2/TP3 levels, sorted per (symbol, side).
+
+    Each pass only returns the orders whose levels lie inside the price range seen
+    since the previous pass (previous/current price widened by the M1 bars' high/low,
+    found with bisect), plus expired orders and orders that are new or changed since
+    the last rebuild. Buy levels are compared with the bid, Sell with the ask
+    (bar bid + bar spread).
+    """
+
+    def __init__(self):
+        self.version = None
+        self.orders = {}      # row_idx -> record
+        self.meta = {}        # row_idx -> (is_buy, sl, tp1, tp2, tp3), nan = missing
+        self.levels = {}      # (symbol, side) -> (sorted levels, owning row_idx)
+        self.symbols = set()
+        self.expiries = []    # sorted (expire datetime, row_idx)
+        self.last_price = {}  # (symbol, side) -> price seen on the previous pass
+        self.last_tick = {}   # symbol -> server time of the previous pass
+        self.armed = {}       # row_idx -> server time from which bar ranges apply
+        self.dirty = set()    # rows to evaluate once regardless of price
+        self.pass_tick = {}   # last_tick as it was when the current pass started
+
+    def rebuild(self, open_orders, version):
+        prev = self.orders
+        self.orders = dict(open_orders)
+        self.dirty = {r for r, rec in self.orders.items() if prev.get(r) is not rec} | (self.dirty & self.orders.keys())
+        self.armed = {r: t for r, t in self.armed.items() if r in self.orders}
+        buckets, expiries, self.meta = {}, [], {}
+        for r, rec in self.orders.items():
+            side = "Buy" if rec.get('Direction', '') == "Buy" else "Sell"
+            bucket = buckets.setdefault((rec.get('Symbol', ''), side), [])
+            vals = [get_float_safe(rec, k) for k in ('SL', 'TP1', 'TP2', 'TP3')]
+            for v in vals:
+                if v is not None:
+                    bucket.append((v, r))
+            if rec.get('Direction', '') in ("Buy", "Sell"):
+                self.meta[r] = (side == "Buy",) + tuple(np.nan if v is None else v for v in vals)
+            try:
+                opened = datetime.strptime(rec.get('Date', ''), "%Y-%m-%d %H:%M:%S")
+                expiries.append((opened + timedelta(hours=ORDER_EXPIRE_HOURS), r))
+            except Exception:
+                pass
+        self.levels = {}
+        for key, items in buckets.items():
+            items.sort()
+            self.levels[key] = ([v for v, _ in items], [r for _, r in items])
+        self.symbols = {sym for sym, _ in self.levels}
+        self.expiries = sorted(expiries)
+        self.version = version
+
+    def remap(self, open_orders):
+        """Carry the per-row state over a renumbering (archive run, moved rows). The
+        index keeps each record object, only its row_idx changes."""
+        new_row = {id(rec): r for r, rec in open_orders}
+        moved = {r: new_row[id(rec)] for r, rec in self.orders.items() if id(rec) in new_row}
+        self.orders = {moved[r]: rec for r, rec in self.orders.items() if r in moved}
+        self.armed = {moved[r]: t for r, t in self.armed.items() if r in moved}
+        self.dirty = {moved[r] for r in self.dirty if r in moved}
+        self.version = None   # levels/meta are rebuilt with the new numbers
+
+    def retry(self):
+        """After a pass whose results were not all applied: evaluate every order again
+        and re-check the bars since that pass started."""
+        self.last_tick = dict(self.pass_tick)
+        self.dirty |= self.orders.keys()
+
+    def _range_hits(self, rows, bars, since, point, digits):
+        """SL/TP hits of `rows` against bars opened at/after max(since, armed time),
+        vectorized over rows x bars. As in backtest.resolve_trade, the first bar with
+        any hit decides, with check_order_status's priority inside that bar."""
+        rows = [r for r in rows if r in self.meta and r in self.armed]
+        if not rows or not len(bars):
+            return {}
+        m = np.array([self.meta[r] for r in rows], dtype=float)
+        start = np.maximum(since, [self.armed[r] for r in rows])
+        row_ids = np.asarray(rows)
+        out = {}
+        for buy in (True, False):
+            sel = (m[:, 0] == 1.0) == buy
+            sel &= ~np.isnan(m[:, 1:]).any(axis=1)
+            if not sel.any():
+                continue
+            sl, tp1, tp2, tp3 = (m[sel, i:i + 1] for i in range(1, 5))
+            # Buy orders exit on the bid; Sell orders on the ask (bid + that bar's spread)
+            shift = 0.0 if buy else bars['spread'] * point
+            low = np.round(bars['low'] + shift, digits)
+            high = np.round(bars['high'] + shift, digits)
+            live = bars['time'] >= start[sel, None]
+            if buy:
+                hits = [low <= sl, high >= tp3, high >= tp2, high >= tp1]
+            else:
+                hits = [high >= sl, low <= tp3, low <= tp2, low <= tp1]
+            hits = [h & live for h in hits]
+            any_hit = np.logical_or.reduce(hits)
+            first = any_hit.argmax(axis=1)
+            at = np.arange(len(first))
+            res = np.select([h[at, first] for h in hits], ["SL", "TP3", "TP2", "TP1"], default="")
+            done = np.flatnonzero(any_hit.any(axis=1))
+            out.update(zip(row_ids[sel][done].tolist(), res[done].tolist()))
+        return out
+
+    def triggered(self, snapshot, now):
+        """(sorted rows to evaluate, {row_idx: result from the bar range})."""
+        rows, self.dirty = self.dirty, set()
+        self.pass_tick = dict(self.last_tick)
+        hits = {}
+        for symbol in self.symbols:
+            tick = snapshot.get(symbol)
+            if tick is None:
+                continue
+            digits = symbol_digits.get(symbol, 2)
+            point = 10 ** (-digits)
+            prev_tick = self.last_tick.get(symbol)
+            self.last_tick[symbol] = tick.time
+            # orders seen for the first time only use bars that opened after that
+            arm_at = (tick.time // 60) * 60 + 60
+            bars = None
+            if prev_tick is not None:
+                since = (prev_tick // 60) * 60
+                bars = get_rates(symbol, RANGE_CHECK_TIMEFRAME, RANGE_CHECK_BARS)
+                bars = bars[bars['time'] >= since]
+            for side in ("Buy", "Sell"):
+                entry = self.levels.get((symbol, side))
+                if not entry:
+                    continue
+                levels, owners = entry
+                for r in owners:
+                    self.armed.setdefault(r, arm_at)
+                price = round(float(tick.bid) if side == "Buy" else float(tick.ask), digits)
+                prev = self.last_price.get((symbol, side))
+                self.last_price[(symbol, side)] = price
+                if prev is None:
+                    rows.update(owners)
+                    continue
+                lo, hi = min(prev, price), max(prev, price)
+                if bars is not None and len(bars):
+                    shift = bars['spread'] * point if side == "Sell" else 0.0
+                    lo = min(lo, round(float((bars['low'] + shift).min()), digits))
+                    hi = max(hi, round(float((bars['high'] + shift).max()), digits))
+                crossed = owners[bisect_left(levels, lo):bisect_right(levels, hi)]
+                rows.update(crossed)
+                if bars is not None and len(bars):
+                    hits.update(self._range_hits(sorted(set(crossed)), bars, since, point, digits))
+        n_expired = bisect_right(self.expiries, (now, float('inf')))
+        rows.update(r for _, r in self.expiries[:n_expired])
+        return sorted(r for r in rows if r in self.orders), hits
+
 def tp_sl_checker_loop():
+    triggers, epoch = TriggerIndex(), None
     while True:
         try:
-            open_orders = find_open_orders()
-            for row_idx, order in open_orders:
-                symbol = order.get('Symbol', '')
-                digits = symbol_digits.get(symbol, 2)
-                result = check_order_status(order, digits)
-                if result and result != order.get('Result', ''):
-                    update_order_result_in_sheet(row_idx, result)
-                    if result != "Running":
-                        msg = build_tp_sl_message(order, result)
+            t0 = time.perf_counter()
+            idx = ensure_order_index()
+            with idx.lock:
+                if idx.epoch != epoch:
+                    triggers.remap(idx.open_orders())   # rows renumbered (archive, moved rows)
+                    epoch = idx.epoch
+                if idx.version != triggers.version:
+                    triggers.rebuild(idx.open_orders(), idx.version)
+            snapshot = get_tick_snapshot() if triggers.orders else None
+            due, range_hits = triggers.triggered(snapshot, datetime.now()) if snapshot else ([], {})
+            for row_idx in due:
+                with idx.lock:
+                    if idx.epoch != epoch:
+                        triggers.retry()  # row numbers changed; redo the pass with the new ones
+                        break
+                    order = triggers.orders[row_idx]
+                    symbol = order.get('Symbol', '')
+                    digits = symbol_digits.get(symbol, 2)
+                    result = range_hits.get(row_idx) or check_order_status(order, digits, snapshot)
+                    if result and result != order.get('Result', ''):
+                        update_order_result_in_sheet(row_idx, result)
+                        metrics.inc("checker_results_total", result=result)
+                        if result != "Running":
+                            msg = build_tp_sl_message(order, result)
+                            root_id = LAST_SIGNAL_MSG_ID.get(symbol)
+                            if root_id:
+                                send_telegram_message(msg, reply_to_message_id=root_id)
+                            else:
+                                send_telegram_message(msg)
+                    elif order_expired(order) and order.get('Result', '') != "Expired":
+                        update_order_result_in_sheet(row_idx, "Expired")
+                        metrics.inc("checker_results_total", result="Expired")
+                        msg = build_tp_sl_message(order, "Expired")
                         root_id = LAST_SIGNAL_MSG_ID.get(symbol)
                         if root_id:
                             send_telegram_message(msg, reply_to_message_id=root_id)
                         else:
                             send_telegram_message(msg)
-                elif order_expired(order) and order.get('Result', '') != "Expired":
-                    update_order_result_in_sheet(row_idx, "Expired")
-                    msg = build_tp_sl_message(order, "Expired")
-                    root_id = LAST_SIGNAL_MSG_ID.get(symbol)
-                    if root_id:
-                        send_telegram_message(msg, reply_to_message_id=root_id)
-                    else:
-                        send_telegram_message(msg)
-
-                # Optional: trail to BE (disabled by default)
-                if TRAIL_TO_BE_AFTER_TP1 and result == "Running":
-                    tick = get_tick(symbol)
-                    if tick:
-                        direction = order.get('Direction','').upper()
-                        entry = float(order.get('Entry',0))
-                        tp1   = float(order.get('TP1',0))
-                        price = float(tick.bid) if direction=="BUY" else float(tick.ask)
-                        hit_tp1 = price >= tp1 if direction=="BUY" else price <= tp1
-                        if hit_tp1:
-                            if round(float(order.get('SL',0)), digits) != round(entry, digits):
-                                update_order_sl_in_sheet(row_idx, format_price(entry, digits))
-                                send_telegram_message(f"🔒 Move SL → BE @ {symbol} ({format_price(entry, digits)})")
-
-            time.sleep(1)
+
+                    # Optional: trail to BE (disabled by default)
+                    if TRAIL_TO_BE_AFTER_TP1 and result == "Running":
+                        tick = snapshot.get(symbol)
+                        if tick:
+                            direction = order.get('Direction','').upper()
+                            entry = float(order.get('Entry',0))
+                            tp1   = float(order.get('TP1',0))
+                            price = float(tick.bid) if direction=="BUY" else float(tick.ask)
+                            hit_tp1 = price >= tp1 if direction=="BUY" else price <= tp1
+                            if hit_tp1:
+                                if round(float(order.get('SL',0)), digits) != round(entry, digits):
+                                    update_order_sl_in_sheet(row_idx, format_price(entry, digits))
+                                    send_telegram_message(f"🔒 Move SL → BE @ {symbol} ({format_price(entry, digits)})")
+
+            metrics.observe("checker_iteration_seconds", time.perf_counter() - t0)
+            time.sleep(TP_SL_CHECK_INTERVAL_SEC)
         except Exception as e:
-            print("❌ TP/SL CHECKER ERROR:", e)
-            traceback.print_exc()
+            metrics.inc("checker_errors_total")
+            log(f"❌ TP/SL CHECKER ERROR: {e}\n{traceback.format_exc()}", "error", "checker")
+            triggers.retry()  # re-check every open order and the bars since the failed pass
             time.sleep(10)
 
 # === SIGNAL GENERATOR ===
+# === SCAN ===
+# At bar close every symbol is checked on a thread pool, so the last symbol in SYMBOLS
+# is decided about as soon as the first. MT5 requests stay serialized by mt5_session
+# (MT5_MAX_CONCURRENT_CALLS); sheet writes go through the local journal.
+SCAN_CONCURRENCY = 8   # worker threads for check_symbol; 1 = sequential
+_SIGNAL_COMMIT_LOCK = threading.Lock()
+_scan_pool = None
+
+def _check_symbol_safe(symbol):
+    t0 = time.perf_counter()
+    try:
+        check_symbol(symbol)
+    except Exception as e:
+        metrics.inc("signal_errors_total", symbol=symbol)
+        log(f"[Scan] {symbol} error: {e}\n{traceback.format_exc()}", "error", "scan")
+    metrics.observe("signal_symbol_seconds", time.perf_counter() - t0)
+
+def scan_symbols(symbols):
+    """check_symbol for every symbol (concurrently); returns the elapsed seconds."""
+    global _scan_pool
+    started = time.monotonic()
+    if SCAN_CONCURRENCY <= 1:
+        for symbol in symbols:
+            _check_symbol_safe(symbol)
+    else:
+        if _scan_pool is None:
+            _scan_pool = ThreadPoolExecutor(max_workers=SCAN_CONCURRENCY, thread_name_prefix="scan")
+        list(_scan_pool.map(_check_symbol_safe, symbols))
+    elapsed = time.monotonic() - started
+    metrics.observe("signal_scan_seconds", elapsed)
+    log(f"[Scan] {len(symbols)} symbols in {elapsed:.2f}s", "info", "scan")
+    return elapsed
+
+def on_signal_bar_close(bar_time):
+    """SIGNAL_TIMEFRAME bar-close job: fresh ticks, scan every symbol, persist EMA state."""
+    get_tick_snapshot(max_age=0)  # fresh ticks for the whole scan
+    # วนตรวจทุกสัญลักษณ์ (ผ่าน Guard ทั้งหมดใน check_symbol)
+    scan_symbols(SYMBOLS)
+    save_ema_state()
+
 def check_symbol(symbol):
-    print(f"\n[DEBUG] check_symbol called: {symbol} at {datetime.now()}")
+    log(f"[DEBUG] check_symbol called: {symbol} at {datetime.now()}", "debug", "scan", symbol=symbol)
+    stages = metrics.stage_timer("signal_stage_seconds")
 
     # Logic 1: BLOCK NEW WHEN RUNNING
     if BLOCK_NEW_WHEN_RUNNING_GLOBAL and has_any_running_order():
-        print(f"   - {symbol}: GLOBAL LOCK active (some order running), skip")
+        log(f"   - {symbol}: GLOBAL LOCK active (some order running), skip", "debug", "scan", symbol=symbol)
         return
     if BLOCK_NEW_WHEN_RUNNING_PER_SYMBOL and has_running_order_for_symbol(symbol):
-        print(f"   - {symbol}: PER-SYMBOL LOCK active (order running), skip")
+        log(f"   - {symbol}: PER-SYMBOL LOCK active (order running), skip", "debug", "scan", symbol=symbol)
         return
 
+    stages.lap("lock_check")
+
+    # One tick snapshot for every guard of this pass (shared with the TP/SL thread)
+    snapshot = get_tick_snapshot()
+    stages.lap("tick_snapshot")
+
     # Logic 2: MARKET GUARD
-    if not is_market_open(symbol):
-        print(f"   - {symbol}: market closed/idle (guard) -> skip")
+    if not is_market_open(symbol, snapshot):
+        log(f"   - {symbol}: market closed/idle (guard) -> skip", "debug", "scan", symbol=symbol)
         return
+    stages.lap("market_guard")
 
-    # Only proceed on real new bar (M15)
-    if not has_new_bar(symbol, mt5.TIMEFRAME_M15):
-        print(f"   - {symbol}: no new M15 bar -> skip")
+    # Only proceed on real new bar (SIGNAL_TIMEFRAME, M15 by default)
+    if not has_new_bar(symbol, SIGNAL_TIMEFRAME):
+        log(f"   - {symbol}: no new {TIMEFRAME_NAMES[SIGNAL_TIMEFRAME]} bar -> skip", "debug", "scan", symbol=symbol)
         return
+    stages.lap("new_bar")
 
     # Logic 3A: SPREAD GUARD
-    tick = get_tick(symbol)
+    tick = snapshot.get(symbol)
     if not tick:
-        print(f"   - {symbol}: No price tick")
+        log(f"   - {symbol}: No price tick", "debug", "scan", symbol=symbol)
         return
     if not spread_ok(symbol, tick):
-        print(f"   - {symbol}: spread too wide -> skip")
+        log(f"   - {symbol}: spread too wide -> skip", "debug", "scan", symbol=symbol)
         return
 
     # Logic 3B: SESSION GUARD (for US indices)
     if symbol in INDEX_SYMBOLS and not in_session_local(symbol, datetime.now()):
-        print(f"   - {symbol}: out-of-session -> skip")
+        log(f"   - {symbol}: out-of-session -> skip", "debug", "scan", symbol=symbol)
         return
+    stages.lap("spread_session_guard")
 
-    candles = get_candles(symbol, mt5.TIMEFRAME_M15, 100)
+    candles = get_candles(symbol, SIGNAL_TIMEFRAME, SIGNAL_BARS)
     if len(candles) < 60:
-        print(f"   - {symbol}: Not enough data")
+        log(f"   - {symbol}: Not enough data", "debug", "scan", symbol=symbol)
         return
+    stages.lap("candles")
 
-    closes = [c['close'] for c in candles]
-    trend = "none"
-    if is_uptrend(closes):
-        trend = "up"
-    elif is_downtrend(closes):
-        trend = "down"
-    else:
-        print(f"   - {symbol}: No clear trend")
+    trend = ema_trend(symbol, SIGNAL_TIMEFRAME, candles)
+    if trend == "none":
+        log(f"   - {symbol}: No clear trend", "debug", "scan", symbol=symbol)
+        return
+    conflict = trend_filter_conflict(symbol, trend)
+    if conflict:
+        log(f"   - {symbol}: {conflict} trend does not confirm {trend} -> skip", "debug", "scan", symbol=symbol)
         return
 
-    pattern, direction = None, None
-    eng = detect_engulfing(candles)
-    pin = is_pinbar(candles)
-    if eng == "Bullish Engulfing" and trend == "up":
-        direction, pattern = "Buy", "Bullish Engulfing"
-    elif eng == "Bearish Engulfing" and trend == "down":
-        direction, pattern = "Sell", "Bearish Engulfing"
-    elif pin == "Pinbar Bottom" and trend == "up":
-        direction, pattern = "Buy", "Pinbar Bottom"
-    elif pin == "Pinbar Top" and trend == "down":
-        direction, pattern = "Sell", "Pinbar Top"
-    elif is_double_top(candles) and trend == "down":
-        direction, pattern = "Sell", "Double Top"
-    elif is_double_bottom(candles) and trend == "up":
-        direction, pattern = "Buy", "Double Bottom"
-    elif is_morning_star(candles) and trend == "up":
-        direction, pattern = "Buy", "Morning Star"
-    elif is_evening_star(candles) and trend == "down":
-        direction, pattern = "Sell", "Evening Star"
-    elif detect_qm(candles) == "QM Buy" and trend == "up":
-        direction, pattern = "Buy", "Quasimodo Buy"
-    elif detect_qm(candles) == "QM Sell" and trend == "down":
-        direction, pattern = "Sell", "Quasimodo Sell"
-    elif detect_imbalance(candles) and trend == "up":
-        direction, pattern = "Buy", "Imbalance Up"
-    elif detect_imbalance(candles) and trend == "down":
-        direction, pattern = "Sell", "Imbalance Down"
-    elif detect_demand_zone(candles) and trend == "up":
-        direction, pattern = "Buy", "Demand Zone"
-    elif detect_supply_zone(candles) and trend == "down":
-        direction, pattern = "Sell", "Supply Zone"
+    want = "Buy" if trend == "up" else "Sell"
+    pattern = detect_patterns(candles).first(want)
+    direction = want if pattern else None
 
     if direction is None:
-        print(f"   - {symbol}: No entry setup (pattern/trend not matched)")
+        log(f"   - {symbol}: No entry setup (pattern/trend not matched)", "debug", "scan", symbol=symbol)
         return
 
     entry = float(tick.ask) if direction == "Buy" else float(tick.bid)
 
-    zones = find_zone_levels(candles, entry, direction)
+    zones = find_zone_levels(candles, entry, direction, symbol=symbol)
     if not zones or len(zones) == 0:
-        print(f"   - {symbol}: No valid zone, reject order")
+        log(f"   - {symbol}: No valid zone, reject order", "debug", "scan", symbol=symbol)
         return
+    stages.lap("detection")
 
     try:
-        sl, [tp1, tp2, tp3] = calculate_sl_tp(symbol, entry, candles, direction)
+        sl, [tp1, tp2, tp3] = calculate_sl_tp(symbol, entry, candles, direction, tick=tick)
     except Exception as ex:
-        print(f"   - {symbol}: SL/TP error: {ex}")
+        log(f"   - {symbol}: SL/TP error: {ex}", "debug", "scan", symbol=symbol)
         return
 
     digits = symbol_digits.get(symbol, 2)
-    # extra validation layer
-    min_gap_map2 = {
-        "EURUSD.A": 0.0012, "GBPUSD.A": 0.0020, "AUDUSD.A": 0.0012, "NZDUSD.A": 0.0012,
-        "EURGBP.A": 0.0010, "USDCAD.A": 0.0015, "USDJPY.A": 0.10, "XAUUSD.A": 0.5,
-        "NAS100.A": 20, "US30.A": 50, "BTCUSD.A": 50
-    }
-    min_gap2 = min_gap_map2.get(symbol, 0.0002)
-    for v in [sl, tp1, tp2, tp3]:
-        if v is None or v == 0 or abs(entry - v) < min_gap2 or v == entry:
-            print(f"   - {symbol}: SL/TP invalid! sl={sl}, tp1={tp1}, tp2={tp2}, tp3={tp3}, entry={entry}")
-            return
-
-    if not check_symbol_for_new_signal(symbol):
-        print(f"   - {symbol}: Duplicate signal in last 30 mins, skip")
+    if not signal_levels_ok(symbol, entry, sl, tp1, tp2, tp3):
+        log(f"   - {symbol}: SL/TP invalid! sl={sl}, tp1={tp1}, tp2={tp2}, tp3={tp3}, entry={entry}", "debug", "scan", symbol=symbol)
         return
+    stages.lap("sl_tp")
 
-    dt_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    row = [dt_str, symbol, direction, entry, sl, tp1, tp2, tp3, "Pending", pattern, "", ""]
-    print(f"   - {symbol}: [DEBUG] appending row: {row}")
-    append_row_with_retry(row)
-    print(f"   - {symbol}: [DEBUG] appended row and preparing telegram...")
+    # Symbols are scanned concurrently: re-check the locks and commit the row atomically
+    with _SIGNAL_COMMIT_LOCK:
+        if BLOCK_NEW_WHEN_RUNNING_GLOBAL and has_any_running_order():
+            log(f"   - {symbol}: GLOBAL LOCK active (some order running), skip", "debug", "scan", symbol=symbol)
+            return
+        if not check_symbol_for_new_signal(symbol):
+            log(f"   - {symbol}: Duplicate signal in last 30 mins, skip", "debug", "scan", symbol=symbol)
+            return
+
+        dt_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        row = [dt_str, symbol, direction, entry, sl, tp1, tp2, tp3, "Pending", pattern, "", ""]
+        log(f"   - {symbol}: [DEBUG] appending row: {row}", "debug", "scan", symbol=symbol)
+        append_row_with_retry(row)
+    stages.lap("sheet_append")
+    metrics.inc("signals_total", symbol=symbol, direction=direction)
+    log(f"   - {symbol}: [DEBUG] appended row and preparing telegram...", "debug", "scan", symbol=symbol)
 
     new_order = {
         "Date": dt_str, "Symbol": symbol, "Direction": direction, "Entry": entry, "SL": sl,
@@ -1048,67 +3133,60 @@ def check_symbol(symbol):
     msg = build_entry_signal_message(new_order)
 
     # 1) Capture -> 2) Send photo FIRST -> 3) Send text as a REPLY to photo
+    # The chart renders in the chart pool; the scan moves on to the next symbol.
     try:
-        chart_path = capture_chart(symbol, entry, sl, tp1, tp2, tp3, bars=100)
+        chart_candles = get_candles(symbol, SIGNAL_TIMEFRAME, SIGNAL_BARS)
         root_msg_id = None
-        if chart_path:
-            cap = f"{symbol} M15 — Entry/SL/TP\n#BTP #Signal"
-            root_msg_id = send_telegram_photo(chart_path, caption=cap, parse_mode=None)
-            if root_msg_id:
-                LAST_SIGNAL_MSG_ID[symbol] = root_msg_id
-        if root_msg_id:
-            send_telegram_message(msg, reply_to_message_id=root_msg_id)
-        else:
-            send_telegram_message(msg)
+        if chart_candles:
+            levels = {'Entry': entry, 'SL': sl, 'TP1': tp1, 'TP2': tp2, 'TP3': tp3}
+            cap = f"{symbol} {TIMEFRAME_NAMES[SIGNAL_TIMEFRAME]} — Entry/SL/TP\n#BTP #Signal"
+            root_msg_id = send_chart_photo(symbol, chart_candles, levels, cap)
+            remember_signal_message(symbol, root_msg_id)
+        stages.lap("chart_submit")
+        # queued right behind the photo; replies to it once its id is known
+        send_telegram_message(msg, reply_to_message_id=root_msg_id, priority=TG_PRIORITY_SIGNAL)
+        stages.lap("telegram_enqueue")
     except Exception as e:
-        log(f"Chart capture/send error: {e}", "warning")
+        log(f"Chart capture/send error: {e}", "warning", "chart")
 
 # === MAIN ===
 if __name__ == "__main__":
-    print("🚀 Auto Signal + TP/SL Tracker + Expire (Real-time) พร้อมใช้งาน!")
+    multiprocessing.freeze_support()  # frozen (PyInstaller) builds spawn chart workers
+    setup_logging()
+    log("🚀 Auto Signal + TP/SL Tracker + Expire (Real-time) พร้อมใช้งาน!")
+
+    # Keep one MT5 connection open for the lifetime of the process
+    if not mt5_session.acquire():
+        log("❌ MT5 Init Fail at startup (will retry on first use)", "warning", "mt5")
 
     # Ensure all symbols are visible in MT5 Market Watch
     mt5_select_symbols(SYMBOLS)
-    print("✅ MT5 symbols are selected (Market Watch)")
+    log("✅ MT5 symbols are selected (Market Watch)")
 
-    # Start TP/SL/Expired checker thread
+    # Fill the base (M15) candle cache once; afterwards only new bars are fetched
+    prime_candle_cache(SYMBOLS, BASE_TIMEFRAME)
+    load_ema_state()
+
+    # Start the coalescing sheet writer and the TP/SL/Expired checker thread
+    threading.Thread(target=sheet_writer_loop, daemon=True).start()
     threading.Thread(target=tp_sl_checker_loop, daemon=True).start()
+    chart_service.start()
+    start_metrics_exporters()
 
-    last_report_date = None
-    last_week_report = None  # stores monday-of-week string
+    # Bar-close jobs, timed on broker server time (first tick snapshot sets the offset)
+    bar_scheduler = BarCloseScheduler(server_clock)
+    bar_scheduler.every(SIGNAL_TIMEFRAME, on_signal_bar_close)
+    bar_scheduler.every(SUMMARY_TIMEFRAME, on_summary_bar_close)
+    get_tick_snapshot(max_age=0)
+    bar_scheduler.run_pending()   # only records the bars already open
+    log(f"[Scheduler] server time offset {server_clock.offset or 0.0:+.1f}s")
 
-    
-while True:
+    while True:
         try:
             # รอให้แท่ง M15 ปิดจริง ก่อนค่อยประมวลผล (กันสัญญาณหลอก)
-            print("⌛ [2] Waiting for M15 candle close before checking signals...")
-            wait_for_m15_close()
-
-            # วนตรวจทุกสัญลักษณ์ (ผ่าน Guard ทั้งหมดใน check_symbol)
-            for symbol in SYMBOLS:
-                check_symbol(symbol)
-
-            # === Schedulers: Daily at 23:00 and Weekly (Mon) at 08:00 ===
-            now = datetime.now()
-            # Daily 23:00 (fire once per day, allow 0-4 min window)
-            today = now.strftime("%Y-%m-%d")
-            if (now.hour == 23) and (0 <= now.minute < 5):
-                if last_report_date != today:
-                    summarize_results_daily()
-                    last_report_date = today
-                    log(f"[Scheduler] Daily summary sent for {today}", "info")
-
-            # Weekly Monday 08:00 (fire once per Monday, allow 0-4 min window)
-            monday_of_week = (now - timedelta(days=now.weekday())).strftime("%Y-%m-%d")
-            if (now.weekday() == 0) and (now.hour == 8) and (0 <= now.minute < 5):
-                if last_week_report != monday_of_week:
-                    summarize_results_weekly()
-                    last_week_report = monday_of_week
-                    log(f"[Scheduler] Weekly summary sent for week starting {monday_of_week}", "info")
-
-            time.sleep(5)
-
+            log(f"⌛ [2] Waiting for {TIMEFRAME_NAMES[SIGNAL_TIMEFRAME]} candle close before checking signals...", "debug")
+            bar_scheduler.wait()
+            bar_scheduler.run_pending()
         except Exception as e:
-            print("❌ MAIN LOOP ERROR:", e)
-            traceback.print_exc()
+            log(f"❌ MAIN LOOP ERROR: {e}\n{traceback.format_exc()}", "error")
             time.sleep(30)
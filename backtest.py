@@ -0,0 +1,381 @@
+# Offline backtest: replays local M15 history through the live signal logic.
+#
+#   python backtest.py --data history/ [--symbols XAUUSD.A EURUSD.A] [--from 2022-01-01]
+#                      [--to 2024-12-31] [--seed 1] [--workers 4] [--out backtest_out]
+#
+# History files live in --data as <SYMBOL>.npy (CANDLE_DTYPE structured array) or
+# <SYMBOL>.csv: either a header with time/open/high/low/close[/tick_volume/spread]
+# (time = epoch seconds or a date string) or MT5's "Export bars" format
+# (<DATE> <TIME> <OPEN> ... <SPREAD>, tab separated). Bar times are MT5 server time.
+#
+# Each decision is made at a bar open, like the live loop right after an M15 close:
+# the window is the previous 99 closed bars plus the new bar as a forming bar that has
+# only just opened (open = high = low = close). Detection, the EMA trend and the
+# guards run vectorized over all bars of a symbol; only the bars that pass them go
+# through find_zone_levels / calculate_sl_tp (seeded RNG for the SL offset) and
+# signal_levels_ok from the live script. A SIGNAL_TIMEFRAME above M15 and the
+# TREND_FILTER_TIMEFRAMES are resampled from the history like the live candle cache
+# does. Outcomes are resolved on the following bars
+# with the checker's priority (SL > TP3 > TP2 > TP1 within a bar) and the
+# ORDER_EXPIRE_HOURS expiry. Symbols run in parallel processes.
+#
+# Without the MetaTrader5 package (Linux), run with MT5_BACKEND=sim: only the import
+# of the live script needs it.
+#
+# Not replayed: the global running-order lock (symbols are independent here), tick
+# freshness (a bar in history is a fresh tick) and the trail-to-BE option.
+import argparse
+import csv
+import importlib.util
+import json
+import os
+import random
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+
+SIGNAL_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "auto_mt5_signal_loop_google_sheet_with_chart.final.py")
+LOCAL_UTC_OFFSET_HOURS = 7   # the live guards use Asia/Bangkok wall-clock time
+WINDOW_BARS = 100            # check_symbol works on get_candles(..., 100)
+MIN_WINDOW_BARS = 60
+M15_SEC = 15 * 60
+
+LEDGER_FIELDS = ["symbol", "direction", "pattern", "entry_time", "entry", "sl", "tp1", "tp2", "tp3",
+                 "result", "exit_time", "exit_price", "r_multiple"]
+
+_sig = None
+
+def load_signal_module():
+    """Import the live script (its file name is not a valid module name)."""
+    global _sig
+    if _sig is None:
+        sys.path.insert(0, os.path.dirname(SIGNAL_SCRIPT))
+        spec = importlib.util.spec_from_file_location("signal_loop", SIGNAL_SCRIPT)
+        mod = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(mod)
+        _sig = mod
+    return _sig
+
+# === DATA ===
+def _parse_times(values):
+    """Date strings ("2024.01.02 00:15:00", "2024-01-02 00:15", ...) -> epoch seconds."""
+    return np.array([str(v).strip().replace(".", "-").replace(" ", "T") for v in values],
+                    dtype="datetime64[s]").astype("i8")
+
+def load_history(path, dtype):
+    """M15 bars from a .npy or .csv file as a `dtype` (CANDLE_DTYPE) array, oldest first."""
+    if path.endswith(".npy"):
+        raw = np.load(path)
+        out = np.zeros(len(raw), dtype=dtype)
+        for name in dtype.names:
+            if name in raw.dtype.names:
+                out[name] = raw[name]
+    else:
+        with open(path, newline="", encoding="utf-8") as f:
+            first = f.readline()
+            f.seek(0)
+            delim = "\t" if "\t" in first else ","
+            rows = list(csv.reader(f, delimiter=delim))
+        header = [h.strip().strip("<>").lower() for h in rows[0]]
+        cols = {h: [r[i] for r in rows[1:] if len(r) > i] for i, h in enumerate(header)}
+        if "date" in cols and "time" in cols:
+            stamps = [f"{d} {t}" for d, t in zip(cols["date"], cols["time"])]
+        else:
+            stamps = cols.get("time") or cols["date"]
+        try:
+            times = np.array(stamps, dtype="i8")
+        except ValueError:
+            times = _parse_times(stamps)
+        out = np.zeros(len(times), dtype=dtype)
+        out["time"] = times
+        aliases = {"tick_volume": ("tick_volume", "tickvol", "volume"), "spread": ("spread",)}
+        for name in dtype.names:
+            if name == "time":
+                continue
+            for key in aliases.get(name, (name,)):
+                if key in cols:
+                    out[name] = np.array(cols[key], dtype=float)
+                    break
+    out = out[np.argsort(out["time"], kind="stable")]
+    keep = np.ones(len(out), dtype=bool)
+    keep[1:] = out["time"][1:] != out["time"][:-1]
+    return out[keep]
+
+def find_history_file(data_dir, symbol):
+    for ext in (".npy", ".csv"):
+        path = os.path.join(data_dir, symbol + ext)
+        if os.path.exists(path):
+            return path
+    return None
+
+# === VECTORIZED SCREENING ===
+class _Lagged:
+    """One feature column seen from every decision bar at once: [-1] is the forming
+    bar, [-k] the closed bar k-1 bars before it (what CandleFeatures gives the
+    detectors for a single window)."""
+
+    def __init__(self, closed, forming, idx):
+        self.closed, self.forming, self.idx = closed, forming, idx
+
+    def __getitem__(self, k):
+        if k == -1:
+            return self.forming
+        return self.closed[self.idx + k + 1]
+
+class LaggedFeatures:
+    """CandleFeatures over all decision bars, so each registered detector returns a
+    bool array (one entry per decision bar) in a single call."""
+
+    def __init__(self, rates, idx):
+        self.n = WINDOW_BARS
+        o, h, l, c = (rates[k].astype(float) for k in ("open", "high", "low", "close"))
+        fo = o[idx]   # forming bar: just opened
+        cols = {
+            "o": (o, fo), "h": (h, fo), "l": (l, fo), "c": (c, fo),
+            "body": (np.abs(c - o), np.zeros_like(fo)),
+            "upper": (h - np.maximum(o, c), np.zeros_like(fo)),
+            "lower": (np.minimum(o, c) - l, np.zeros_like(fo)),
+            "range": (h - l, np.zeros_like(fo)),
+        }
+        for name, (closed, forming) in cols.items():
+            setattr(self, name, _Lagged(closed, forming, idx))
+
+def _local_times(epochs, server_utc_offset):
+    shift = int((LOCAL_UTC_OFFSET_HOURS - server_utc_offset) * 3600)
+    return (epochs + shift).astype("datetime64[s]")
+
+def _htf_trend(sig, rates, idx, timeframe, price):
+    """trend_filter_conflict per decision bar: EMA of `timeframe` bars resampled from
+    the history, closed through the bar before the one each decision falls in."""
+    sec = sig.TIMEFRAME_SECONDS[timeframe]
+    htf = sig.resample_rates(rates, sec)
+    e = sig.ema(htf["close"].astype(float), sig.EMA_PERIOD)
+    b = np.searchsorted(htf["time"], rates["time"][idx] // sec * sec)
+    prev = np.where(b > 0, e[np.maximum(b - 1, 0)], np.nan)
+    alpha = 2.0 / (sig.EMA_PERIOD + 1.0)
+    cur = alpha * price + (1 - alpha) * prev
+    return price > cur, price < cur
+
+def screen_symbol(sig, symbol, rates, idx, server_utc_offset):
+    """(decision idx, direction, pattern) for every bar where the guards pass, the EMA
+    trend is clear and a detector of the trend's direction fires."""
+    # EMA through the last closed bar, then the forming bar's close (= its open)
+    e = sig.ema(rates["close"].astype(float), sig.EMA_PERIOD)
+    alpha = 2.0 / (sig.EMA_PERIOD + 1.0)
+    price = rates["open"][idx].astype(float)
+    cur = alpha * price + (1 - alpha) * e[idx - 1]
+    up, down = price > cur, price < cur
+    for tf in sig.TREND_FILTER_TIMEFRAMES:
+        htf_up, htf_down = _htf_trend(sig, rates, idx, tf, price)
+        up &= htf_up
+        down &= htf_down
+
+    # guards: weekend policy, spread, US index sessions
+    local = _local_times(rates["time"][idx], server_utc_offset)
+    weekday = ((local.astype("datetime64[D]").astype("i8") + 3) % 7)  # 1970-01-01 was a Thursday
+    ok = np.isin(weekday, list(sig.ACTIVE_WEEKDAYS_LOCAL)) | (symbol in sig.WEEKEND_ALLOWED_SYMBOLS)
+    if sig.FOREX_WEEKEND_BLOCK and sig.is_forex_symbol(symbol):
+        ok &= np.isin(weekday, list(sig.ACTIVE_WEEKDAYS_LOCAL))
+    if not sig.MARKET_GUARD_ENABLED:
+        ok[:] = True
+    limit = sig.SPREAD_MAX_MAP.get(symbol)
+    if limit is not None:
+        ok &= rates["spread"][idx] <= limit
+    if symbol in sig.INDEX_SYMBOLS and symbol in sig.SESSION_WINDOWS_LOCAL:
+        minute = (local - local.astype("datetime64[D]")).astype("i8") // 60
+        in_session = np.zeros(len(idx), dtype=bool)
+        for sh, sm, eh, em in sig.SESSION_WINDOWS_LOCAL[symbol]:
+            start, end = sh * 60 + sm, eh * 60 + em
+            if start <= end:
+                in_session |= (minute >= start) & (minute <= end)
+            else:
+                in_session |= (minute >= start) | (minute <= end)
+        ok &= in_session
+
+    f = LaggedFeatures(rates, idx)
+    fired = {}
+    for d in sig.PATTERN_DETECTORS:
+        if d.func not in fired:
+            fired[d.func] = np.asarray(d.func(f), dtype=bool)
+    out = []
+    for direction, trend in (("Buy", up), ("Sell", down)):
+        # registration order is the priority order (PatternResult.first)
+        name_idx = np.full(len(idx), -1)
+        for k, d in reversed(list(enumerate(sig.PATTERN_DETECTORS))):
+            if d.direction == direction:
+                name_idx = np.where(fired[d.func], k, name_idx)
+        hit = ok & trend & (name_idx >= 0)
+        for j in np.flatnonzero(hit):
+            out.append((int(idx[j]), direction, sig.PATTERN_DETECTORS[name_idx[j]].name))
+    out.sort()
+    return out
+
+# === OUTCOMES ===
+def resolve_trade(rates, t, direction, sl, tp1, tp2, tp3, point, expire_sec):
+    """(result, exit bar idx, exit price) from bar t (entry at its open) onwards."""
+    t0 = int(rates["time"][t])
+    end = int(np.searchsorted(rates["time"], t0 + expire_sec, side="left"))
+    win = rates[t:end]
+    if direction == "Buy":
+        lo, hi = win["low"], win["high"]
+        hits = [(lo <= sl, "SL", sl), (hi >= tp3, "TP3", tp3), (hi >= tp2, "TP2", tp2), (hi >= tp1, "TP1", tp1)]
+    else:
+        spr = win["spread"] * point
+        lo, hi = win["low"] + spr, win["high"] + spr
+        hits = [(hi >= sl, "SL", sl), (lo <= tp3, "TP3", tp3), (lo <= tp2, "TP2", tp2), (lo <= tp1, "TP1", tp1)]
+    any_hit = np.logical_or.reduce([h for h, _, _ in hits])
+    if any_hit.any():
+        k = int(np.argmax(any_hit))
+        for h, name, level in hits:
+            if h[k]:
+                return name, t + k, level
+    last = max(t, end - 1)
+    return "Expired", last, float(rates["close"][last])
+
+def backtest_symbol(job):
+    """Replay one symbol; returns (symbol, list of ledger rows)."""
+    symbol, path, seed, start, stop, server_utc_offset = job
+    sig = load_signal_module()
+    rates = load_history(path, sig.CANDLE_DTYPE)
+    bar_sec = sig.TIMEFRAME_SECONDS[sig.SIGNAL_TIMEFRAME]
+    if bar_sec > M15_SEC:
+        rates = sig.resample_rates(rates, bar_sec)
+    if start is not None:
+        rates = rates[rates["time"] >= start - WINDOW_BARS * bar_sec * 4]
+    if stop is not None:
+        rates = rates[rates["time"] < stop]
+    if len(rates) <= WINDOW_BARS:
+        return symbol, []
+    idx = np.arange(WINDOW_BARS - 1, len(rates))
+    if start is not None:
+        idx = idx[rates["time"][idx] >= start]
+    digits = sig.symbol_digits.get(symbol, 2)
+    point = 10 ** (-digits)
+    expire_sec = sig.ORDER_EXPIRE_HOURS * 3600
+    rng = random.Random(seed ^ zlib.crc32(symbol.encode()))
+
+    ledger = []
+    blocked_until = -1   # per-symbol running-order lock + 30 min duplicate guard
+    for t, direction, pattern in screen_symbol(sig, symbol, rates, idx, server_utc_offset):
+        t_open = int(rates["time"][t])
+        if t_open < blocked_until:
+            continue
+        win = rates[t - WINDOW_BARS + 1:t + 1].copy()
+        o = win["open"][-1]
+        win["high"][-1] = win["low"][-1] = win["close"][-1] = o
+        candles = sig.Candles(win)
+        if len(candles) < MIN_WINDOW_BARS:
+            continue
+        spread = float(win["spread"][-1]) * point
+        tick = sig.Tick(t_open, float(o), float(o) + spread)
+        entry = float(tick.ask) if direction == "Buy" else float(tick.bid)
+        if not sig.find_zone_levels(candles, entry, direction):
+            continue
+        try:
+            sl, (tp1, tp2, tp3) = sig.calculate_sl_tp(symbol, entry, candles, direction, tick=tick, rng=rng)
+        except Exception:
+            continue
+        if not sig.signal_levels_ok(symbol, entry, sl, tp1, tp2, tp3):
+            continue
+        result, k, exit_price = resolve_trade(rates, t, direction, sl, tp1, tp2, tp3, point, expire_sec)
+        exit_time = int(rates["time"][k]) if result != "Expired" else t_open + expire_sec
+        risk = abs(entry - sl)
+        pnl = (exit_price - entry) if direction == "Buy" else (entry - exit_price)
+        ledger.append({
+            "symbol": symbol, "direction": direction, "pattern": pattern,
+            "entry_time": _fmt_time(t_open), "entry": round(entry, digits),
+            "sl": sl, "tp1": tp1, "tp2": tp2, "tp3": tp3,
+            "result": result, "exit_time": _fmt_time(exit_time), "exit_price": round(exit_price, digits),
+            "r_multiple": round(pnl / risk, 3) if risk else 0.0,
+        })
+        if sig.BLOCK_NEW_WHEN_RUNNING_PER_SYMBOL:
+            blocked_until = max(exit_time + 1, t_open + 1800)
+        else:
+            blocked_until = t_open + 1800
+    return symbol, ledger
+
+def _fmt_time(epoch):
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+# === REPORT ===
+def summarize(trades):
+    n = len(trades)
+    tp = sum(1 for t in trades if t["result"].startswith("TP"))
+    sl = sum(1 for t in trades if t["result"] == "SL")
+    expired = n - tp - sl
+    r = [t["r_multiple"] for t in trades]
+    return {
+        "trades": n, "tp": tp, "sl": sl, "expired": expired,
+        "win_rate": round(tp / n, 4) if n else 0.0,
+        "total_r": round(sum(r), 3), "avg_r": round(sum(r) / n, 4) if n else 0.0,
+        "by_result": {k: sum(1 for t in trades if t["result"] == k) for k in ("TP1", "TP2", "TP3", "SL", "Expired")},
+    }
+
+def run(data_dir, symbols, seed=1, start=None, stop=None, workers=None, server_utc_offset=0.0):
+    jobs = []
+    for symbol in symbols:
+        path = find_history_file(data_dir, symbol)
+        if path is None:
+            print(f"   - {symbol}: no history file in {data_dir}, skip")
+            continue
+        jobs.append((symbol, path, seed, start, stop, server_utc_offset))
+    ledger = []
+
+    def collect(results):
+        for symbol, rows in results:
+            print(f"   - {symbol}: {len(rows)} trades")
+            ledger.extend(rows)
+
+    if workers == 1 or len(jobs) <= 1:
+        collect(map(backtest_symbol, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            collect(pool.map(backtest_symbol, jobs))
+    ledger.sort(key=lambda r: (r["entry_time"], r["symbol"]))
+    stats = {"total": summarize(ledger), "by_symbol": {}, "by_pattern": {}}
+    for key, field in (("by_symbol", "symbol"), ("by_pattern", "pattern")):
+        for value in sorted({t[field] for t in ledger}):
+            stats[key][value] = summarize([t for t in ledger if t[field] == value])
+    return ledger, stats
+
+def _parse_day(s):
+    return None if not s else int(datetime.strptime(s, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp())
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Replay M15 history through the signal logic.")
+    ap.add_argument("--data", required=True, help="directory with <SYMBOL>.npy/.csv files")
+    ap.add_argument("--symbols", nargs="*", help="default: SYMBOLS from the live script")
+    ap.add_argument("--from", dest="start", help="first decision day, YYYY-MM-DD (server time)")
+    ap.add_argument("--to", dest="stop", help="stop before this day, YYYY-MM-DD (server time)")
+    ap.add_argument("--seed", type=int, default=1, help="seed for the SL offset RNG")
+    ap.add_argument("--workers", type=int, default=None, help="processes (default: CPU count)")
+    ap.add_argument("--server-utc-offset", type=float, default=0.0, help="MT5 server time zone, hours")
+    ap.add_argument("--out", default="backtest_out", help="output directory")
+    args = ap.parse_args(argv)
+
+    sig = load_signal_module()
+    symbols = args.symbols or sig.SYMBOLS
+    started = time.perf_counter()
+    ledger, stats = run(args.data, symbols, args.seed, _parse_day(args.start), _parse_day(args.stop),
+                        args.workers, args.server_utc_offset)
+    stats["elapsed_sec"] = round(time.perf_counter() - started, 2)
+
+    os.makedirs(args.out, exist_ok=True)
+    with open(os.path.join(args.out, "ledger.csv"), "w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=LEDGER_FIELDS)
+        w.writeheader()
+        w.writerows(ledger)
+    with open(os.path.join(args.out, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(stats, f, indent=2)
+    t = stats["total"]
+    print(f"✅ {t['trades']} trades | TP {t['tp']} SL {t['sl']} Expired {t['expired']} | "
+          f"win {t['win_rate']:.1%} | total R {t['total_r']} | {stats['elapsed_sec']}s -> {args.out}")
+    return stats
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+# Benchmarks for the bar-close path and the TP/SL checker, runnable offline.
+#
+#   python bench_signal.py [--suite micro macro checker] [--repeat 20] [--orders 1000]
+#                          [--symbols 21] [--latency-ms 0] [--failure-rate 0]
+#                          [--data history/] [--out bench.json]
+#   python bench_signal.py --compare old.json new.json [--threshold 0.15] [--threshold scan_21=0.3]
+#
+# The live script is imported against mt5_sim (synthetic random-walk bars, or recorded
+# M15 bars from --data in backtest.py's formats) on a virtual clock, so nothing talks
+# to a terminal, Google Sheets or Telegram. --symbols above 21 adds simulated symbols
+# (SIM0001, ...) to SYMBOLS, and --latency-ms / --failure-rate apply to every MT5
+# call, to see how the scan and the checker scale. Results are JSON
+# ({"meta": ..., "results": {name: {median_ms, p95_ms, ...}}}); --compare exits with
+# status 1 when a benchmark's median got slower than the threshold allows.
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import Future
+from datetime import datetime
+
+import numpy as np
+
+import backtest
+import mt5_sim
+
+SHEET_HEADERS = ["Date", "Symbol", "Direction", "Entry", "SL", "TP1", "TP2", "TP3", "Result", "Pattern", "Msg", "Note"]
+DEFAULT_THRESHOLD = 0.15   # fail --compare when a median is >15% slower
+
+# === SETUP ===
+def _done(value=None):
+    fut = Future()
+    fut.set_result(value)
+    return fut
+
+def load_signal_with_sim(workdir, n_symbols=None):
+    """Import the live script against mt5_sim with Sheets/Telegram/chart output disabled."""
+    os.environ["MT5_BACKEND"] = "sim"
+    sig = backtest.load_signal_module()
+    if n_symbols and n_symbols != len(sig.SYMBOLS):
+        extra = [f"SIM{i:04d}" for i in range(1, max(0, n_symbols - len(sig.SYMBOLS)) + 1)]
+        sig.SYMBOLS = (list(sig.SYMBOLS) + extra)[:n_symbols]
+        sig.SYMBOL_INDEX = {s: i for i, s in enumerate(sig.SYMBOLS)}
+    sig.mt5_session.acquire()   # held for the whole run, as the main loop does
+    sig.order_journal = sig.OrderJournal(os.path.join(workdir, "orders_journal.db"))
+    sig.order_journal.import_rows(SHEET_HEADERS, [])
+    sig.order_index = sig.OrderIndex()
+    sig.telegram_sender.submit = lambda *a, **k: _done()
+    sig.send_chart_photo = lambda *a, **k: _done()
+    # results must not depend on the weekday/hour the bench runs at
+    sig.ACTIVE_WEEKDAYS_LOCAL = set(range(7))
+    sig.SESSION_WINDOWS_LOCAL = {}
+    return sig
+
+MIN_SAMPLE_SEC = 0.005   # tiny functions are looped until one sample takes this long
+
+def timeit(fn, repeat, setup=None, warmup=1):
+    """Per-call timings (ms) over `repeat` samples. Without a per-call setup, each
+    sample loops fn enough times to reach MIN_SAMPLE_SEC, which keeps the noise
+    of sub-millisecond functions down."""
+    for _ in range(warmup):
+        if setup:
+            setup()
+        t = time.perf_counter()
+        fn()
+        first = time.perf_counter() - t
+    number = 1 if setup else max(1, int(MIN_SAMPLE_SEC / max(first, 1e-9)))
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        t = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - t) / number)
+    ms = np.array(samples) * 1000.0
+    return {
+        "median_ms": round(float(np.median(ms)), 4), "p95_ms": round(float(np.percentile(ms, 95)), 4),
+        "min_ms": round(float(ms.min()), 4), "mean_ms": round(float(ms.mean()), 4),
+        "runs": repeat, "loops": number,
+    }
+
+@contextlib.contextmanager
+def quiet():
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+# === SUITES ===
+def bench_micro(sig, mt5, repeat):
+    symbol = "XAUUSD.A"
+    tf = mt5.TIMEFRAME_M15
+    sig.prime_candle_cache([symbol], tf)
+    candles = sig.get_candles(symbol, tf, 100)
+    closes = mt5_sim.simulator().bars(symbol, mt5.TIMEFRAME_M1, 0, 5000)['close']
+    entry = float(candles.close[-1])
+    tick = sig.Tick(int(candles.time[-1]), entry, entry + 0.02)
+    rng = random.Random(1)
+    levels = {'Entry': entry, 'SL': entry * 0.99, 'TP1': entry * 1.01, 'TP2': entry * 1.02, 'TP3': entry * 1.03}
+    key = f"{symbol}|{tf}|{sig.EMA_PERIOD}"
+
+    def one_bar_old_state():
+        prev = float(sig.ema(candles.close[:-2], sig.EMA_PERIOD)[-1])
+        sig._EMA_STATE[key] = {"time": int(candles.time[-3]), "value": prev}
+
+    def ring_new_bar():
+        mt5.advance(900)
+
+    results = {
+        "ema_5000": timeit(lambda: sig.ema(closes, sig.EMA_PERIOD), repeat),
+        "ema_trend_incremental": timeit(lambda: sig.ema_trend(symbol, tf, candles), repeat, setup=one_bar_old_state),
+        "detect_patterns_100": timeit(lambda: sig.detect_patterns(candles), repeat),
+        "find_zone_levels_100": timeit(lambda: (sig.find_zone_levels(candles, entry, "Buy"),
+                                                sig.find_zone_levels(candles, entry, "Sell")), repeat),
+        "calculate_sl_tp": timeit(lambda: (sig._ZONE_CACHE.clear(),
+                                           sig.calculate_sl_tp(symbol, entry, candles, "Buy", tick=tick, rng=rng)), repeat),
+        "candle_sync_new_bar": timeit(lambda: sig.get_rates(symbol, tf, 100), repeat,
+                                      setup=lambda: (ring_new_bar(), setattr(sig.get_candle_ring(symbol, tf), "synced_at", 0.0))),
+        "render_chart": timeit(lambda: sig.chart_render.render_chart(symbol, candles.rates, levels),
+                               max(3, repeat // 4)),
+    }
+    return results
+
+def bench_macro(sig, mt5, repeat):
+    symbols = list(sig.SYMBOLS)
+    tf = mt5.TIMEFRAME_M15
+    sig.prime_candle_cache(symbols, tf)
+
+    def new_bar():
+        mt5.advance(900)
+        with sig.order_index.lock:   # no running-order locks between runs
+            sig.order_index.load([], SHEET_HEADERS)
+        for s in symbols:
+            sig.LAST_BAR_TIME[(s, tf)] = 0
+
+    def scan():
+        with quiet():
+            sig.get_tick_snapshot(max_age=0)
+            sig.scan_symbols(symbols)
+
+    return {f"scan_{len(symbols)}": timeit(scan, repeat, setup=new_bar)}
+
+def make_open_orders(sig, mt5, n, seed=3):
+    rng = np.random.default_rng(seed)
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    rows = []
+    for i in range(n):
+        symbol = sig.SYMBOLS[i % len(sig.SYMBOLS)]
+        price = float(mt5_sim.simulator().tick(symbol).bid)
+        buy = bool(rng.random() < 0.5)
+        k = 1 if buy else -1
+        d = price * 0.002 * (1 + rng.random())
+        rows.append((i + 2, {
+            "Date": now, "Symbol": symbol, "Direction": "Buy" if buy else "Sell", "Entry": price,
+            "SL": price - k * 1.5 * d, "TP1": price + k * d, "TP2": price + k * 2 * d, "TP3": price + k * 3 * d,
+            "Result": "Running", "Pattern": "bench", "Msg": "", "Note": "",
+        }))
+    return rows
+
+def bench_checker(sig, mt5, repeat, n_orders):
+    rows = make_open_orders(sig, mt5, n_orders)
+    open_orders = dict(rows)
+    triggers = sig.TriggerIndex()
+    sig.prime_candle_cache(sig.SYMBOLS, mt5.TIMEFRAME_M1)
+    snapshot = {}
+
+    def tick():
+        mt5.advance(5)
+        snapshot["s"] = sig.take_tick_snapshot()
+
+    tick()
+    triggers.triggered(snapshot["s"], datetime.now())
+    results = {
+        f"trigger_rebuild_{n_orders}": timeit(lambda: triggers.rebuild(open_orders, object()), repeat),
+        f"checker_pass_indexed_{n_orders}": timeit(lambda: triggers.triggered(snapshot["s"], datetime.now()),
+                                                   repeat, setup=tick),
+        f"checker_pass_fullscan_{n_orders}": timeit(
+            lambda: [sig.check_order_status(o, sig.symbol_digits.get(o["Symbol"], 2), snapshot["s"])
+                     for o in open_orders.values()], repeat, setup=tick),
+    }
+    return results
+
+SUITES = {"micro": bench_micro, "macro": bench_macro, "checker": bench_checker}
+
+# === RESULTS ===
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+def run(suites, repeat=20, n_orders=1000, data_dir=None, n_symbols=None, latency_ms=0.0, failure_rate=0.0):
+    mt5_sim.configure(data_dir=data_dir, clock="virtual", latency_ms=latency_ms, failure_rate=failure_rate)
+    mt5 = mt5_sim
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        sig = load_signal_with_sim(workdir, n_symbols)
+        for name in suites:
+            if name == "checker":
+                results.update(bench_checker(sig, mt5, repeat, n_orders))
+            else:
+                results.update(SUITES[name](sig, mt5, repeat))
+        if sig.order_journal._db is not None:
+            sig.order_journal._db.close()   # let the temp dir go on Windows
+    return {
+        "meta": {
+            "commit": _git_commit(), "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+            "repeat": repeat, "orders": n_orders, "data": data_dir or "synthetic",
+            "symbols": len(sig.SYMBOLS), "latency_ms": latency_ms, "failure_rate": failure_rate,
+            "scan_concurrency": sig.SCAN_CONCURRENCY, "mt5_calls": mt5_sim.call_counts(),
+        },
+        "results": results,
+    }
+
+def compare(old, new, threshold=DEFAULT_THRESHOLD, per_bench=None):
+    """Rows of (name, old ms, new ms, change, regressed) for benchmarks in both files."""
+    per_bench = per_bench or {}
+    rows = []
+    for name, cur in new["results"].items():
+        prev = old["results"].get(name)
+        if prev is None:
+            continue
+        a, b = prev["median_ms"], cur["median_ms"]
+        change = (b - a) / a if a else 0.0
+        rows.append((name, a, b, change, change > per_bench.get(name, threshold)))
+    return rows
+
+def print_results(doc):
+    for name, r in doc["results"].items():
+        print(f"{name:<34} median {r['median_ms']:>10.3f} ms   p95 {r['p95_ms']:>10.3f} ms")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark the signal loop offline.")
+    ap.add_argument("--suite", nargs="*", choices=sorted(SUITES), default=["micro", "macro", "checker"])
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--orders", type=int, default=1000, help="open orders for the checker suite")
+    ap.add_argument("--symbols", type=int, default=None, help="scan this many symbols (extra ones are simulated)")
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="simulated latency per MT5 call")
+    ap.add_argument("--failure-rate", type=float, default=0.0, help="share of MT5 calls that fail")
+    ap.add_argument("--data", help="recorded M15 bars (<SYMBOL>.npy/.csv) instead of synthetic ones")
+    ap.add_argument("--out", help="write the results JSON here")
+    ap.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files")
+    ap.add_argument("--threshold", action="append", default=[],
+                    help="allowed slowdown, e.g. 0.15 or name=0.3 (repeatable)")
+    args = ap.parse_args(argv)
+
+    threshold, per_bench = DEFAULT_THRESHOLD, {}
+    for t in args.threshold:
+        if "=" in t:
+            name, value = t.split("=", 1)
+            per_bench[name] = float(value)
+        else:
+            threshold = float(t)
+
+    if args.compare:
+        with open(args.compare[0], encoding="utf-8") as f:
+            old = json.load(f)
+        with open(args.compare[1], encoding="utf-8") as f:
+            new = json.load(f)
+        rows = compare(old, new, threshold, per_bench)
+        for name, a, b, change, bad in rows:
+            print(f"{'❌' if bad else '✅'} {name:<34} {a:>10.3f} -> {b:>10.3f} ms  ({change:+.1%})")
+        return 1 if any(r[4] for r in rows) else 0
+
+    doc = run(args.suite, args.repeat, args.orders, args.data, args.symbols, args.latency_ms, args.failure_rate)
+    print_results(doc)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(doc, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+# Chart renderer for the signal loop.
+# Kept in its own module so chart worker processes import only numpy/matplotlib,
+# not the MT5 / Google Sheet side of the main script.
+import io
+
+import numpy as np
+
+# --- Plot backend for headless environments ---
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection, PolyCollection
+
+CHART_DPI = 150
+
+LEVEL_COLORS = {'Entry': 'orange', 'SL': 'red', 'TP1': 'green', 'TP2': 'green', 'TP3': 'green'}
+
+def render_chart(symbol, rates, levels, dpi=CHART_DPI, timeframe="M15"):
+    """Render candles (structured array with open/high/low/close) with the level
+    lines in `levels` ({'Entry': price, 'SL': ..., ...}); returns PNG bytes.
+
+    Wicks are one LineCollection and bodies one PolyCollection, drawn on a bare
+    Figure (no pyplot state) straight into memory.
+    """
+    opens, closes = rates['open'], rates['close']
+    highs, lows   = rates['high'], rates['low']
+    n = len(rates)
+    x = np.arange(n, dtype=float)
+    colors_ = np.where(closes >= opens, 'green', 'red')
+
+    fig = Figure(figsize=(10,5))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+
+    wicks = np.stack([np.column_stack([x, lows]), np.column_stack([x, highs])], axis=1)
+    ax.add_collection(LineCollection(wicks, colors=colors_, linewidths=1))
+    lower = np.minimum(opens, closes)
+    height = np.abs(opens - closes)
+    height = np.where(height > 1e-6, height, 0.0001)
+    upper = lower + height
+    bodies = np.stack([
+        np.column_stack([x - 0.35, lower]), np.column_stack([x + 0.35, lower]),
+        np.column_stack([x + 0.35, upper]), np.column_stack([x - 0.35, upper]),
+    ], axis=1)
+    ax.add_collection(PolyCollection(bodies, facecolors=colors_, edgecolors=colors_))
+
+    for label, price in levels.items():
+        color = LEVEL_COLORS.get(label, 'gray')
+        ax.axhline(price, color=color, linestyle='--', linewidth=1)
+        ax.text(n+0.8, price, f"{label} {price:.2f}", va='center', color=color, fontsize=10)
+
+    ax.text(0.5, 0.5, "BTP", transform=ax.transAxes, fontsize=90, color='gray', alpha=0.15, ha='center', va='center', fontweight='bold')
+
+    for side in ['left','bottom','right','top']:
+        ax.spines[side].set_visible(False)
+    ax.get_xaxis().set_visible(False)
+    ax.get_yaxis().set_visible(False)
+
+    # collections don't autoscale y; cover candles and every level line
+    y_lo = min(float(lows.min()), *levels.values())
+    y_hi = max(float(highs.max()), *levels.values())
+    pad = (y_hi - y_lo) * 0.05 or abs(y_hi) * 1e-4 or 1.0
+    ax.set_ylim(y_lo - pad, y_hi + pad)
+    ax.set_xlim(-1, n+6)
+    ax.set_title(f"{symbol} {timeframe} (Entry/SL/TP)")
+
+    # fixed margins (right one leaves room for the level labels) instead of
+    # tight_layout/bbox_inches="tight", which each cost an extra draw
+    fig.subplots_adjust(left=0.01, right=0.90, bottom=0.02, top=0.93)
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=dpi)
+    return buf.getvalue()
+
+def warm_up():
+    """Pool initializer: pay for font loading and the first Agg draw up front."""
+    rates = np.zeros(2, dtype=[('open', 'f8'), ('high', 'f8'), ('low', 'f8'), ('close', 'f8')])
+    rates['high'] = 1.0
+    render_chart("warmup", rates, {'Entry': 0.5}, dpi=20)
@@ -0,0 +1,279 @@
+# Simulated MetaTrader5 terminal for load tests on machines without MT5.
+#
+# Drop-in for the parts of the MetaTrader5 package the signal loop uses
+# (initialize/shutdown/last_error/terminal_info, copy_rates_from_pos,
+# symbol_info_tick, symbol_info, symbol_select, TIMEFRAME_*). The live script uses it
+# when MT5_BACKEND=sim:
+#
+#   MT5_BACKEND=sim MT5_SIM_LATENCY_MS=3 MT5_SIM_FAILURE_RATE=0.01 python auto_mt5_...py
+#
+# Prices are a per-symbol 1-minute random walk (or recorded M15 bars from
+# MT5_SIM_DATA, replayed forward and interpolated to minutes); every timeframe is
+# aggregated from those minutes, so M1/M15 bars and ticks always agree. The clock is
+# the wall clock unless configure(clock="virtual") is used, then advance() moves it.
+#
+# Environment: MT5_SIM_DATA (dir of <SYMBOL>.npy/.csv), MT5_SIM_SEED,
+# MT5_SIM_HISTORY_BARS (M15 bars before start), MT5_SIM_LATENCY_MS,
+# MT5_SIM_JITTER_MS, MT5_SIM_FAILURE_RATE.
+import os
+import random
+import threading
+import time
+import types
+import zlib
+
+import numpy as np
+
+TIMEFRAME_M1  = 1
+TIMEFRAME_M5  = 5
+TIMEFRAME_M15 = 15
+TIMEFRAME_M30 = 30
+TIMEFRAME_H1  = 16385
+TIMEFRAME_H4  = 16388
+TIMEFRAME_D1  = 16408
+_TF_MINUTES = {TIMEFRAME_M1: 1, TIMEFRAME_M5: 5, TIMEFRAME_M15: 15, TIMEFRAME_M30: 30,
+               TIMEFRAME_H1: 60, TIMEFRAME_H4: 240, TIMEFRAME_D1: 1440}
+
+RES_S_OK = 1
+RES_E_NO_CONNECTION = -10004   # MT5's "No IPC connection"
+
+RATES_DTYPE = np.dtype([('time', '<i8'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'), ('close', '<f8'),
+                        ('tick_volume', '<u8'), ('spread', '<i4'), ('real_volume', '<u8')])
+
+# base price, digits, spread (points), 1-minute volatility; other symbols use _DEFAULT_PROFILE
+_PROFILES = {
+    "EURUSD.A": (1.08, 5, 10, 0.0002), "GBPUSD.A": (1.27, 5, 12, 0.0002), "AUDUSD.A": (0.66, 5, 10, 0.0002),
+    "NZDUSD.A": (0.60, 5, 12, 0.0002), "USDCAD.A": (1.36, 5, 12, 0.0002), "USDCHF.A": (0.88, 5, 12, 0.0002),
+    "EURGBP.A": (0.85, 5, 10, 0.00015), "USDJPY.A": (150.0, 3, 10, 0.0002), "EURJPY.A": (162.0, 3, 15, 0.0002),
+    "GBPJPY.A": (190.0, 3, 20, 0.00025), "AUDJPY.A": (99.0, 3, 15, 0.00025), "CADJPY.A": (110.0, 3, 15, 0.00025),
+    "NZDJPY.A": (90.0, 3, 15, 0.00025), "US30.A": (38000.0, 1, 30, 0.0003), "NAS100.A": (17500.0, 2, 150, 0.0004),
+    "US500.A": (5000.0, 2, 50, 0.0003), "JPN225.A": (38000.0, 1, 70, 0.0004), "XAUUSD.A": (2000.0, 2, 20, 0.0003),
+    "XAGUSD.A": (23.0, 3, 20, 0.0005), "BTCUSD.A": (60000.0, 2, 1500, 0.0008), "ETHUSD.A": (3000.0, 2, 300, 0.0008),
+}
+_DEFAULT_PROFILE = (100.0, 2, 2, 0.0004)
+
+class _Series:
+    """1-minute bars of one symbol from `origin`, extended a day at a time."""
+    CHUNK = 1440
+
+    def __init__(self, symbol, origin, minutes, seed, replay=None):
+        self.price, self.digits, self.spread, self.vol = _PROFILES.get(symbol, _DEFAULT_PROFILE)
+        self.origin = origin
+        self.rng = np.random.default_rng([seed, zlib.crc32(symbol.encode())])
+        self.replay = replay
+        self.o = self.h = self.l = self.c = np.empty(0)
+        self.lock = threading.Lock()
+        self.extend(minutes)
+
+    def __len__(self):
+        return len(self.c)
+
+    def extend(self, minutes):
+        n = max(minutes, len(self) + self.CHUNK) - len(self)
+        if self.replay is not None:
+            o, h, l, c = self.replay.take(len(self), n)
+        else:
+            last = self.c[-1] if len(self) else self.price
+            c = last * np.exp(np.cumsum(self.rng.normal(0, self.vol, n)))
+            o = np.r_[last, c[:-1]]
+            h = np.maximum(o, c) * (1 + np.abs(self.rng.normal(0, self.vol / 2, n)))
+            l = np.minimum(o, c) * (1 - np.abs(self.rng.normal(0, self.vol / 2, n)))
+        point = 10.0 ** -self.digits
+        o, h, l, c = (np.round(x / point) * point for x in (o, h, l, c))
+        self.o, self.h = np.r_[self.o, o], np.r_[self.h, h]
+        self.l, self.c = np.r_[self.l, l], np.r_[self.c, c]
+
+class _Replay:
+    """Recorded M15 bars spread over minutes: open -> low -> high -> close for up bars,
+    open -> high -> low -> close for down bars; repeats from the start when exhausted."""
+
+    def __init__(self, bars):
+        o, h, l, c = (bars[k].astype(float) for k in ("open", "high", "low", "close"))
+        up = c >= o
+        first, second = np.where(up, l, h), np.where(up, h, l)
+        knots = np.stack([o, first, second, c], axis=1)   # at minutes 0, 5, 10, 15
+        x = np.arange(16) / 5.0
+        path = np.stack([np.interp(x, [0, 1, 2, 3], k) for k in knots])   # (bars, 16)
+        self.c = path[:, 1:].reshape(-1)
+        self.o = path[:, :-1].reshape(-1)
+        self.h = np.maximum(self.o, self.c)
+        self.l = np.minimum(self.o, self.c)
+
+    def take(self, start, n):
+        idx = (start + np.arange(n)) % len(self.c)
+        return self.o[idx], self.h[idx], self.l[idx], self.c[idx]
+
+class Simulator:
+    def __init__(self, data_dir=None, seed=7, history_bars=520, latency_ms=0.0, jitter_ms=0.0,
+                 failure_rate=0.0, clock="wall", start=None):
+        self.seed = seed
+        self.history_minutes = history_bars * 15
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.failure_rate = failure_rate
+        self.virtual = clock == "virtual"
+        self._now = float(start if start is not None else time.time())
+        # minute 0 of every series; whole days so bars line up with MT5's grid
+        self.origin = int(self._now) // 86400 * 86400 - (self.history_minutes // 1440 + 1) * 86400
+        self.replays = _load_replays(data_dir) if data_dir else {}
+        self.series = {}
+        self.lock = threading.Lock()
+        self.rand = random.Random(seed)
+        self.connected = False
+        self.error = (RES_S_OK, "Success")
+        self.calls = {}
+
+    # --- clock ---
+    def now(self):
+        return self._now if self.virtual else time.time()
+
+    def advance(self, seconds):
+        self._now += seconds
+
+    # --- plumbing ---
+    def _call(self, name):
+        """Count, delay and maybe fail one request; False when it fails."""
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + self.rand.uniform(-self.jitter, self.jitter)))
+        if not self.connected:
+            self.error = (RES_E_NO_CONNECTION, "No IPC connection")
+            return False
+        if self.failure_rate and self.rand.random() < self.failure_rate:
+            self.error = (RES_E_NO_CONNECTION, "No IPC connection (simulated)")
+            return False
+        self.error = (RES_S_OK, "Success")
+        return True
+
+    def _series(self, symbol):
+        s = self.series.get(symbol)
+        if s is None:
+            with self.lock:
+                s = self.series.get(symbol)
+                if s is None:
+                    replay = self.replays.get(symbol)
+                    s = self.series[symbol] = _Series(symbol, self.origin, self._minute() + 1, self.seed,
+                                                      _Replay(replay) if replay is not None else None)
+        m = self._minute() + 1
+        if len(s) < m:
+            with s.lock:
+                if len(s) < m:
+                    s.extend(m)
+        return s
+
+    def _minute(self):
+        return int(self.now() - self.origin) // 60
+
+    def bars(self, symbol, timeframe, start_pos, count):
+        """Newest bars of `timeframe` up to the current (forming) one, like copy_rates_from_pos."""
+        s = self._series(symbol)
+        step = _TF_MINUTES.get(timeframe)
+        if step is None:
+            return None
+        cur = self._minute()                     # forming minute, visible so far
+        last_bar = cur // step - start_pos       # newest bar index to return
+        first_bar = max(0, last_bar - count + 1)
+        if last_bar < 0:
+            return np.empty(0, dtype=RATES_DTYPE)
+        lo, hi = first_bar * step, min((last_bar + 1) * step, cur + 1)
+        starts = np.arange(lo, hi, step) - lo
+        out = np.zeros(len(starts), dtype=RATES_DTYPE)
+        out['time'] = self.origin + (first_bar + np.arange(len(starts))) * step * 60
+        ends = np.r_[starts[1:], hi - lo] - 1
+        out['open'] = s.o[lo:hi][starts]
+        out['close'] = s.c[lo:hi][ends]
+        out['high'] = np.maximum.reduceat(s.h[lo:hi], starts)
+        out['low'] = np.minimum.reduceat(s.l[lo:hi], starts)
+        out['tick_volume'] = (ends - starts + 1) * 12
+        out['spread'] = s.spread
+        return out
+
+    def tick(self, symbol):
+        s = self._series(symbol)
+        bid = float(s.c[self._minute()])
+        ask = round(bid + s.spread * 10.0 ** -s.digits, s.digits)
+        now = self.now()
+        return types.SimpleNamespace(time=int(now), time_msc=int(now * 1000), bid=bid, ask=ask,
+                                     last=bid, volume=0, flags=6)
+
+def _load_replays(data_dir):
+    from backtest import load_history
+    out = {}
+    for name in sorted(os.listdir(data_dir)):
+        symbol, ext = os.path.splitext(name)
+        if ext in (".npy", ".csv"):
+            out[symbol] = load_history(os.path.join(data_dir, name), RATES_DTYPE)
+    return out
+
+_sim = None
+
+def configure(**kwargs):
+    """(Re)create the simulator; keyword arguments as for Simulator. Returns it."""
+    global _sim
+    _sim = Simulator(**kwargs)
+    return _sim
+
+def _from_env():
+    return configure(
+        data_dir=os.environ.get("MT5_SIM_DATA") or None,
+        seed=int(os.environ.get("MT5_SIM_SEED", "7")),
+        history_bars=int(os.environ.get("MT5_SIM_HISTORY_BARS", "520")),
+        latency_ms=float(os.environ.get("MT5_SIM_LATENCY_MS", "0")),
+        jitter_ms=float(os.environ.get("MT5_SIM_JITTER_MS", "0")),
+        failure_rate=float(os.environ.get("MT5_SIM_FAILURE_RATE", "0")),
+    )
+
+def simulator():
+    return _sim or _from_env()
+
+def advance(seconds):
+    simulator().advance(seconds)
+
+def call_counts():
+    return dict(simulator().calls)
+
+# === MetaTrader5 API ===
+def initialize(*args, **kwargs):
+    sim = simulator()
+    sim.connected = True
+    if not sim._call("initialize"):
+        sim.connected = False
+        return False
+    return True
+
+def shutdown():
+    simulator().connected = False
+    return True
+
+def last_error():
+    return simulator().error
+
+def terminal_info():
+    sim = simulator()
+    if not sim._call("terminal_info"):
+        return None
+    return types.SimpleNamespace(connected=True, trade_allowed=False, name="MT5 simulator", build=0)
+
+def copy_rates_from_pos(symbol, timeframe, start_pos, count):
+    sim = simulator()
+    if not sim._call("copy_rates_from_pos"):
+        return None
+    return sim.bars(symbol, timeframe, start_pos, count)
+
+def symbol_info_tick(symbol):
+    sim = simulator()
+    if not sim._call("symbol_info_tick"):
+        return None
+    return sim.tick(symbol)
+
+def symbol_info(symbol):
+    sim = simulator()
+    if not sim._call("symbol_info"):
+        return None
+    price, digits, spread, _ = _PROFILES.get(symbol, _DEFAULT_PROFILE)
+    return types.SimpleNamespace(name=symbol, visible=True, select=True, digits=digits,
+                                 point=10.0 ** -digits, spread=spread, trade_tick_size=10.0 ** -digits)
+
+def symbol_select(symbol, enable=True):
+    return simulator()._call("symbol_select")